@@ -156,6 +156,11 @@ $PYTHON_CMD -m venv $PYTHON_ENV
 $PYTHON_ENV/bin/pip install --upgrade pip > /dev/null
 $PYTHON_ENV/bin/pip install fastapi uvicorn httpx pyyaml > /dev/null
 echo "✓ Python dependencies installed"
+if $PYTHON_ENV/bin/pip install orjson uvloop httptools > /dev/null 2>&1; then
+    echo "✓ Optional speedups installed (orjson, uvloop, httptools)"
+else
+    echo "⚠ Optional speedups not installed; the router uses the standard library instead"
+fi
 
 # Generate config.json
 BACKENDS_JSON=""
@@ -350,6 +355,7 @@ Environment="TABBY_CONFIG_PATH=$TABBY_CONFIG_PATH"
 Environment="TABBY_MODEL_DIR=$TABBY_MODEL_DIR"
 Environment="PATH=$PYTHON_ENV/bin:/usr/local/sbin:/usr/local/bin:/usr/sbin:/usr/bin:/sbin:/bin"
 ExecStart=$PYTHON_ENV/bin/python $INSTALL_DIR/router.py
+ExecReload=/bin/kill -HUP \$MAINPID
 Restart=always
 RestartSec=10
 StandardOutput=journal
@@ -104,10 +104,10 @@ print(f"\n✓ Model '{model_name}' added successfully!")
 PYEOF
     
     echo ""
-    read -p "Restart router service now? (y/n): " RESTART
-    if [[ "$RESTART" =~ ^[Yy]$ ]]; then
-        echo "Restarting router..."
-        systemctl restart llm-router.service
+    read -p "Reload router config now? (y/n): " RELOAD
+    if [[ "$RELOAD" =~ ^[Yy]$ ]]; then
+        echo "Reloading router..."
+        systemctl reload llm-router.service
         echo "Done!"
     fi
 }
@@ -147,6 +147,12 @@ try:
 except Exception as e:
     print(f"\nError: {e}")
 PYEOF
+
+    read -p "Reload router config now? (y/n): " RELOAD
+    if [[ "$RELOAD" =~ ^[Yy]$ ]]; then
+        systemctl reload llm-router.service
+        echo "Done!"
+    fi
 }
 
 # Main menu
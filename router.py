@@ -3,13 +3,24 @@
 Multi-Backend LLM Router v4.0.0
 Using systemd services for reliable backend management
 """
+from contextlib import asynccontextmanager, aclosing, AsyncExitStack
 from fastapi import FastAPI, Request
-from fastapi.responses import StreamingResponse
-import httpx, subprocess, asyncio, logging, uvicorn, json, time, os
+from fastapi.responses import StreamingResponse, PlainTextResponse, JSONResponse, Response
+import httpx, asyncio, logging, uvicorn, json, time, os, collections, re, bisect, hashlib, heapq, shlex, signal, types, sqlite3, tempfile, importlib.util
+
+# Optional fast path: orjson for event and body (de)serialisation, stdlib json otherwise. Both emit
+# compact UTF-8 bytes so frames look the same whichever is installed.
+try:
+    import orjson
+    dumps, loads = orjson.dumps, orjson.loads
+except ImportError:
+    orjson = None
+    def dumps(obj): return json.dumps(obj, ensure_ascii=False, separators=(",", ":")).encode()
+    # json.loads sniffs the encoding of bytes in Python; events and bodies are always UTF-8
+    def loads(data): return json.loads(data.decode() if isinstance(data, bytes) else data)
 
 logging.basicConfig(level=logging.INFO, format='[%(asctime)s] %(levelname)s: %(message)s')
 logger = logging.getLogger(__name__)
-app = FastAPI(title="Multi-Backend LLM Router", version="4.0.0")
 
 CONFIG_FILE = os.getenv("ROUTER_CONFIG", "/opt/llm-router/config.json")
 # TabbyAPI paths - configurable via environment or config
@@ -18,12 +29,30 @@ TABBY_MODEL_DIR = os.getenv("TABBY_MODEL_DIR", "/opt/models")
 
 try:
     config = json.load(open(CONFIG_FILE))
-    backends = config.get("backends", {})
-    SGLANG_PORT = backends.get("sglang", {}).get("port", 30000)
-    TABBY_PORT = backends.get("tabbyapi", {}).get("port", 5000)
-    LLAMACPP_PORT = backends.get("llamacpp", {}).get("port", 8085)
+    BACKENDS = config.get("backends", {})
+    SGLANG_PORT = BACKENDS.get("sglang", {}).get("port", 30000)
+    TABBY_PORT = BACKENDS.get("tabbyapi", {}).get("port", 5000)
+    LLAMACPP_PORT = BACKENDS.get("llamacpp", {}).get("port", 8085)
     MODELS = config.get("models", {})
     MODEL_LOAD_TIMEOUT = config.get("model_load_timeout", 300)
+    SWITCH_GRACE_PERIOD = config.get("switch_grace_period", 30)
+    SCHEDULER = config.get("scheduler", {})
+    SERVICE_MANAGER = config.get("service_manager", "systemd")
+    PLACEMENT = config.get("placement", {})
+    READINESS = config.get("readiness", {})
+    HEALTH_CACHE_TTL = config.get("health_cache_ttl", 2.0)
+    NON_STREAMING_SWITCH = config.get("non_streaming_switch", "wait")
+    EMBEDDING_BATCH = config.get("embedding_batch", {})
+    AFFINITY = config.get("affinity", {})
+    ADMISSION = config.get("admission", {})
+    PREWARM = config.get("prewarm", {})
+    REQUEST_LOG = config.get("request_log", {})
+    RESPONSE_CACHE = config.get("response_cache", {})
+    SERVICE_COMMANDS = config.get("service_commands", {})
+    ADMIN_TOKEN = config.get("admin_token")
+    CONFIG_WATCH_INTERVAL = config.get("config_watch_interval", 0)
+    WORKERS = config.get("workers", 1)
+    COORDINATION = config.get("coordination", {})
     ROUTER_PORT = config.get("router_port", 8002)
     # Override from config if present
     TABBY_CONFIG_PATH = config.get("tabby_config_path", TABBY_CONFIG_PATH)
@@ -31,74 +60,1724 @@ try:
     logger.info(f"Loaded {len(MODELS)} models: {list(MODELS.keys())}")
 except Exception as e:
     logger.error(f"Config error: {e}")
-    MODELS, ROUTER_PORT, MODEL_LOAD_TIMEOUT = {}, 8002, 300
+    config, MODELS, ROUTER_PORT, MODEL_LOAD_TIMEOUT, BACKENDS, CONFIG_WATCH_INTERVAL = {}, {}, 8002, 300, {}, 0
+    SWITCH_GRACE_PERIOD, SCHEDULER, SERVICE_MANAGER, PLACEMENT, READINESS = 30, {}, "systemd", {}, {}
+    HEALTH_CACHE_TTL, NON_STREAMING_SWITCH, EMBEDDING_BATCH, AFFINITY, ADMISSION = 2.0, "wait", {}, {}, {}
+    PREWARM, ADMIN_TOKEN, REQUEST_LOG, SERVICE_COMMANDS, RESPONSE_CACHE = {}, None, {}, {}, {}
     SGLANG_PORT, TABBY_PORT, LLAMACPP_PORT = 30000, 5000, 8085
+    WORKERS, COORDINATION = 1, {}
+
+# Workers of one router share its port, so they find each other through a per-port state file by default
+if WORKERS > 1 and not COORDINATION.get("path"):
+    COORDINATION = {**COORDINATION, "path": os.path.join(tempfile.gettempdir(), f"llm-router-{ROUTER_PORT}.db")}
+
+READY_MIN_INTERVAL = READINESS.get("min_interval", 0.1)
+READY_MAX_INTERVAL = READINESS.get("max_interval", 2.0)
+PROGRESS_INTERVAL = READINESS.get("progress_interval", 10)
+# Endpoints a backend serves unless its config lists `endpoints` ("*" passes everything through)
+DEFAULT_ENDPOINTS = ["/v1/chat/completions", "/v1/completions"]
+DEFAULT_PORTS = {"sglang": 30000, "tabbyapi": 5000, "llamacpp": 8085}
+
+# Global state: which model each backend is serving (None until the first switch, when it is unknown)
+state = {"current_model": None, "loaded": None}
+
+def resident_models():
+    return list((state["loaded"] or {}).values())
+
+class Placement:
+    """Decides which resident models must be evicted before another one can be loaded.
+
+    Each model may declare a `footprint` per resource pool (e.g. {"vram_gb": 40})
+    and `placement.resources` gives each pool's capacity. A backend serves one
+    model at a time, so the model on the target backend is always evicted; other
+    residents are evicted only while the new model does not fit, chosen by
+    `placement.eviction`: "lru" (least recently used first) or "cost" (cheapest
+    to reload first, using the model's `load_cost` or its last measured load
+    time). Without a configured capacity, or for models without a footprint,
+    every resident model is evicted as before.
+    """
+    def __init__(self, cfg):
+        self.capacity = cfg.get("resources", {})
+        self.eviction = cfg.get("eviction", "lru")
+        self.last_used = {}
+        self.load_times = {}
+
+    def touch(self, model):
+        self.last_used[model] = time.monotonic()
+
+    def loaded(self, model, seconds):
+        self.load_times[model] = seconds
+
+    def fits(self, models):
+        return all(sum(MODELS[m]["footprint"].get(pool, 0) for m in models) <= cap for pool, cap in self.capacity.items())
+
+    def victim(self, candidates):
+        if self.eviction == "cost":
+            return min(candidates, key=lambda m: (MODELS.get(m, {}).get("load_cost", self.load_times.get(m, 0)), self.last_used.get(m, 0)))
+        return min(candidates, key=lambda m: self.last_used.get(m, 0))
+
+    def plan(self, model):
+        """Resident models that have to be stopped to load model"""
+        loaded = state["loaded"] or {}
+        resident = list(loaded.values())
+        if not self.capacity or "footprint" not in MODELS[model]:
+            return resident
+        backend = MODELS[model]["backend"]
+        evict = [loaded[backend]] if backend in loaded else []
+        # Models without a declared footprint are assumed to fill the machine
+        evict += [m for m in resident if m not in evict and "footprint" not in MODELS.get(m, {})]
+        keep = [m for m in resident if m not in evict]
+        while keep and not self.fits(keep + [model]):
+            m = self.victim(keep)
+            keep.remove(m)
+            evict.append(m)
+        return evict
+
+class FifoPolicy:
+    """Switch to the model of the oldest queued request as soon as anything is queued"""
+    def pick(self, waiting, busy, now):
+        return min(waiting, key=lambda m: waiting[m][0].arrival)
+
+class MostWaitingPolicy:
+    """Keep serving loaded models while they have work in flight, then switch to the model with
+    the most queued requests (oldest request breaks ties). `busy(m)` is the number of in-flight
+    requests on the models that loading m would evict."""
+    def pick(self, waiting, busy, now):
+        free = [m for m in waiting if not busy(m)]
+        if not free:
+            return None
+        return max(free, key=lambda m: (len(waiting[m]), -waiting[m][0].arrival))
+
+class WeightedFairPolicy:
+    """Like most-waiting, but queue lengths are scaled by per-model `weight`, and any request
+    queued longer than `max_wait` seconds forces a switch to its model"""
+    def __init__(self, weights, max_wait):
+        self.weights = weights
+        self.max_wait = max_wait
+
+    def pick(self, waiting, busy, now):
+        oldest = min(waiting, key=lambda m: waiting[m][0].arrival)
+        if now - waiting[oldest][0].arrival >= self.max_wait:
+            return oldest
+        free = [m for m in waiting if not busy(m)]
+        if not free:
+            return None
+        return max(free, key=lambda m: (self.weights.get(m, 1.0) * len(waiting[m]), -waiting[m][0].arrival))
+
+    def deadline(self, waiting):
+        return min(q[0].arrival for q in waiting.values()) + self.max_wait
+
+def make_policy(cfg):
+    name = cfg.get("policy", "weighted-fair")
+    if name == "fifo":
+        return FifoPolicy()
+    if name == "most-waiting":
+        return MostWaitingPolicy()
+    if name != "weighted-fair":
+        logger.warning(f"Unknown scheduler policy {name!r}, using weighted-fair")
+    weights = {m: info["weight"] for m, info in MODELS.items() if "weight" in info}
+    return WeightedFairPolicy(weights, cfg.get("max_wait", 120))
+
+class Waiter:
+    __slots__ = ("arrival", "future")
+
+    def __init__(self):
+        self.arrival = time.monotonic()
+        self.future = asyncio.get_running_loop().create_future()
+
+class ModelLease:
+    """Reader/writer lease on the loaded models, held for the whole generation.
+
+    Any number of requests share each resident model. Requests for a model
+    that is not loaded are queued per model, and the scheduling policy decides
+    when to switch and to which model, so interleaved requests are served in
+    batches instead of thrashing between models. The oldest queued request for
+    the chosen model performs the switch: the placement picks which residents
+    to evict, and their in-flight streams get up to `grace` seconds to drain
+    before those backends are stopped. New requests for the models being
+    evicted are turned away with a 503 (see refuse()) rather than admitted
+    into a drain that would cut them off; models that stay resident keep
+    serving throughout.
+    """
+    def __init__(self, grace, policy, placement):
+        self.grace = grace
+        self.policy = policy
+        self.placement = placement
+        self.active = collections.Counter()
+        self.phase = None  # None, "draining" or "switching"
+        self.evicting = []
+        self.waiting = {}  # model -> deque of Waiter, oldest first
+        self._changed = asyncio.Event()
+        self._timer = None
+
+    def _notify(self):
+        self._changed.set()
+        self._changed = asyncio.Event()
+        self._schedule()
+
+    def admissible(self, model):
+        """Whether a request for model would be admitted right now without waiting"""
+        return model in resident_models() and model not in self.evicting and model not in coordinator.blocked
+
+    def _admit(self, model):
+        self.active[model] += 1
+        self.placement.touch(model)
+
+    def _schedule(self):
+        """Admit queued requests for loaded models and let the policy pick the next switch"""
+        for model in [m for m in self.waiting if self.admissible(m)]:
+            for w in self.waiting.pop(model):
+                self._admit(model)
+                w.future.set_result(False)
+        if self.phase is not None or not self.waiting:
+            return
+        busy = lambda m: sum(self.active[e] for e in self.placement.plan(m))
+        model = self.policy.pick(self.waiting, busy, time.monotonic())
+        if model is None:
+            # Re-check when the oldest request hits the policy's wait bound
+            if hasattr(self.policy, "deadline"):
+                if self._timer:
+                    self._timer.cancel()
+                delay = max(0.0, self.policy.deadline(self.waiting) - time.monotonic())
+                self._timer = asyncio.get_running_loop().call_later(delay, self._schedule)
+            return
+        queue = self.waiting[model]
+        w = queue.popleft()
+        if not queue:
+            del self.waiting[model]
+        self.phase = "draining"
+        self.evicting = self.placement.plan(model)
+        w.future.set_result(True)
+
+    async def acquire(self, model):
+        """Take a shared lease on model. Returns True if the caller must perform the switch
+        (drain(), then switched() or failed()), False once model is loaded and leased."""
+        w = self.join(model)
+        return False if w is None else await self.wait(model, w)
+
+    def join(self, model):
+        """First half of acquire(): lease model now (None), or queue for it and return the Waiter to
+        pass to wait(). Its future is already done when the caller was granted the switch at once."""
+        if self.admissible(model):
+            self._admit(model)
+            return None
+        w = Waiter()
+        self.waiting.setdefault(model, collections.deque()).append(w)
+        self._schedule()
+        return w
+
+    async def wait(self, model, w):
+        try:
+            # Shielded so a cancelled caller leaves w.future pending and can tell whether it was granted
+            return await asyncio.shield(w.future)
+        except asyncio.CancelledError:
+            self.leave(model, w)
+            raise
+
+    def leave(self, model, w):
+        """Withdraw a queued request whose caller went away"""
+        if not w.future.done():
+            self.waiting[model].remove(w)
+            if not self.waiting[model]:
+                del self.waiting[model]
+        elif w.future.result():
+            # Granted the switch just as the client went away: let someone else have it
+            self.failed()
+        else:
+            self.release(model)
+
+    def queued(self):
+        return {m: len(q) for m, q in self.waiting.items()}
+
+    def draining(self):
+        return sum(self.active[m] for m in self.evicting) + coordinator.remote_active(self.evicting)
+
+    async def drain(self):
+        """Wait for in-flight requests on the evicted models to finish, yielding the number still active every few seconds"""
+        deadline = time.monotonic() + self.grace
+        while self.draining() and time.monotonic() < deadline:
+            yield self.draining()
+            changed = self._changed
+            try:
+                await asyncio.wait_for(changed.wait(), min(5, deadline - time.monotonic()))
+            except asyncio.TimeoutError:
+                pass
+        if self.draining():
+            logger.warning(f"Switch grace period ({self.grace}s) expired with {self.draining()} request(s) still streaming")
+        self.phase = "switching"
+        if state["loaded"] is not None:
+            state["loaded"] = {b: m for b, m in state["loaded"].items() if m not in self.evicting}
+        if state["current_model"] in self.evicting:
+            state["current_model"] = None
+        self._notify()
+
+    def switched(self, model):
+        """Finish a switch; the caller keeps a shared lease on the new model"""
+        state["loaded"] = {**(state["loaded"] or {}), MODELS[model]["backend"]: model}
+        state["current_model"] = model
+        self.phase = None
+        self.evicting = []
+        coordinator.finish()
+        self._admit(model)
+        self._notify()
+
+    def failed(self):
+        if self.phase == "switching" and state["loaded"] is not None:
+            state["loaded"] = {b: m for b, m in state["loaded"].items() if m not in self.evicting}
+        self.phase = None
+        self.evicting = []
+        coordinator.finish()
+        self._notify()
+
+    def release(self, model):
+        self.active[model] -= 1
+        self._notify()
+
+lease = ModelLease(SWITCH_GRACE_PERIOD, make_policy(SCHEDULER), Placement(PLACEMENT))
+
+class Coordinator:
+    """Shares model state between router processes (`workers` > 1, or several routers on one host)
+    through a SQLite file (`coordination.path`); without one every method is a no-op.
+
+    Only the worker holding the switch lease stops and starts backends. It takes the lease before
+    draining (renewing it while it works; it expires after `coordination.lease_ttl` seconds if the
+    worker dies), drains the evicted models' streams on every worker, and publishes the new loaded
+    map when done. Every `coordination.poll_interval` seconds each worker publishes its in-flight
+    and queued requests with a heartbeat, picks up the loaded map, and stops admitting requests for
+    models another worker is stopping. Config reloads in one worker are repeated by the others.
+    """
+    def __init__(self, cfg):
+        self.path = cfg.get("path")
+        self.poll_interval = cfg.get("poll_interval", 0.25)
+        self.lease_ttl = cfg.get("lease_ttl", 30)
+        self.stale = max(5.0, 10 * self.poll_interval)  # heartbeat age after which a worker is ignored
+        self.worker = f"{os.getpid()}"
+        self.db = None
+        self.lock = asyncio.Lock()
+        self.task = None
+        self.holding = False
+        self.version = self.config_version = 0
+        self.blocked = set()  # models another worker is stopping
+        self.peers = {}  # worker -> {"active": {model: n}, "queued": {model: n}}
+
+    def remote_active(self, models):
+        return sum(p["active"].get(m, 0) for p in self.peers.values() for m in models)
+
+    async def call(self, fn, *args):
+        async with self.lock:
+            return await asyncio.to_thread(fn, *args)
+
+    def transaction(self, fn, *args):
+        self.db.execute("BEGIN IMMEDIATE")
+        try:
+            result = fn(*args)
+        except BaseException:
+            self.db.execute("ROLLBACK")
+            raise
+        self.db.execute("COMMIT")
+        return result
+
+    def shared(self, key):
+        row = self.db.execute("SELECT value, version FROM shared WHERE key = ?", (key,)).fetchone()
+        return (json.loads(row[0]), row[1]) if row else (None, 0)
+
+    def put(self, key, value, bump=False):
+        self.db.execute("INSERT INTO shared VALUES (?, ?, ?) ON CONFLICT(key) DO UPDATE SET value = excluded.value, "
+                        "version = shared.version + excluded.version", (key, json.dumps(value), int(bump)))
+
+    def _open(self):
+        self.db = sqlite3.connect(self.path, timeout=10, isolation_level=None, check_same_thread=False)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute("CREATE TABLE IF NOT EXISTS shared (key TEXT PRIMARY KEY, value TEXT, version INTEGER NOT NULL)")
+        self.db.execute("CREATE TABLE IF NOT EXISTS workers (worker TEXT PRIMARY KEY, active TEXT, queued TEXT, heartbeat REAL)")
+        def join():
+            # The first live worker starts from scratch: what backends run is unknown after a restart
+            if not self.db.execute("SELECT 1 FROM workers WHERE heartbeat > ?", (time.time() - self.stale,)).fetchone():
+                self.db.execute("DELETE FROM shared WHERE key IN ('loaded', 'switch')")
+                self.db.execute("DELETE FROM workers")
+            self.db.execute("INSERT OR REPLACE INTO workers VALUES (?, '{}', '{}', ?)", (self.worker, time.time()))
+            return self.shared("loaded"), self.shared("config")[1]
+        return self.transaction(join)
+
+    def _poll(self, active, queued):
+        def poll():
+            now = time.time()
+            self.db.execute("UPDATE workers SET active = ?, queued = ?, heartbeat = ? WHERE worker = ?",
+                            (json.dumps(active), json.dumps(queued), now, self.worker))
+            switch, _ = self.shared("switch")
+            if self.holding and switch and switch["worker"] == self.worker:
+                self.put("switch", {**switch, "expires": now + self.lease_ttl})
+            peers = self.db.execute("SELECT worker, active, queued FROM workers WHERE worker != ? AND heartbeat > ?",
+                                    (self.worker, now - self.stale)).fetchall()
+            return self.shared("loaded"), switch, self.shared("config")[1], peers
+        return self.transaction(poll)
+
+    def _take(self, model, evicting):
+        """Take the switch lease unless a live worker holds it; returns the loaded map or None"""
+        def take():
+            switch, _ = self.shared("switch")
+            if switch and switch["worker"] != self.worker and switch["expires"] > time.time():
+                return None
+            self.put("switch", {"worker": self.worker, "model": model, "evicting": evicting, "phase": "draining",
+                                "expires": time.time() + self.lease_ttl})
+            return self.shared("loaded")
+        return self.transaction(take)
+
+    def _announce(self, evicting):
+        def announce():
+            switch, _ = self.shared("switch")
+            self.put("switch", {**switch, "evicting": evicting, "phase": "switching"})
+        self.transaction(announce)
+
+    def _publish(self, loaded):
+        def publish():
+            if loaded is not None:
+                self.put("loaded", loaded, bump=True)
+            self.db.execute("DELETE FROM shared WHERE key = 'switch' AND json_extract(value, '$.worker') = ?", (self.worker,))
+            return self.shared("loaded")[1]
+        return self.transaction(publish)
+
+    def _bump_config(self):
+        def bump():
+            self.put("config", None, bump=True)
+            return self.shared("config")[1]
+        return self.transaction(bump)
+
+    def apply(self, shared):
+        """Adopt a loaded map another worker published; returns whether anything changed"""
+        value, version = shared
+        if version == self.version or value is None:
+            return False
+        self.version = version
+        state["loaded"] = value["loaded"]
+        state["current_model"] = value["current"]
+        return True
+
+    async def open(self):
+        if not self.path:
+            return
+        loaded, self.config_version = await self.call(self._open)
+        self.apply(loaded)
+        self.task = asyncio.create_task(self.run())
+        logger.info(f"Coordinating with other router workers through {self.path} (worker {self.worker})")
+
+    async def close(self):
+        if not self.db:
+            return
+        self.task.cancel()
+        def leave():
+            self.db.execute("DELETE FROM workers WHERE worker = ?", (self.worker,))
+            self.db.execute("DELETE FROM shared WHERE key = 'switch' AND json_extract(value, '$.worker') = ?", (self.worker,))
+        await self.call(self.transaction, leave)
+        self.db.close()
+        self.db = None
+
+    async def run(self):
+        while True:
+            await asyncio.sleep(self.poll_interval)
+            try:
+                loaded, switch, config_version, peers = await self.call(self._poll, dict(+lease.active), lease.queued())
+            except sqlite3.Error as e:
+                logger.warning(f"Coordination poll failed: {e}")
+                continue
+            changed = not self.holding and self.apply(loaded)
+            blocked = set()
+            if switch and switch["worker"] != self.worker and switch["phase"] == "switching" and switch["expires"] > time.time():
+                blocked = set(switch["evicting"])
+            peers = {w: {"active": json.loads(a), "queued": json.loads(q)} for w, a, q in peers}
+            changed |= blocked != self.blocked or (lease.phase is not None and peers != self.peers)
+            self.blocked, self.peers = blocked, peers
+            if config_version > self.config_version:
+                self.config_version = config_version
+                spawn(reload_quietly("peer"))
+            if changed:
+                lease._notify()
+
+    async def begin(self, model):
+        """Wait for the switch lease (yielding loading statuses while another worker switches), then adopt
+        the loaded map it left behind. The caller recomputes what to evict from that map."""
+        if not self.path:
+            return
+        start = time.monotonic()
+        last = None
+        while True:
+            try:
+                loaded = await self.call(self._take, model, lease.evicting)
+            except asyncio.CancelledError:
+                spawn(self.call(self._publish, None))  # in case the lease was taken as we were cancelled
+                raise
+            if loaded is not None:
+                self.holding = True
+                self.apply(loaded)
+                return
+            elapsed = int(time.monotonic() - start)
+            if last is None or elapsed - last >= PROGRESS_INTERVAL:
+                last = elapsed
+                yield {"status": "loading", "elapsed": elapsed, "detail": "another router worker is switching models"}
+            await asyncio.sleep(self.poll_interval)
+
+    async def announce(self, evicting):
+        """Tell the other workers to stop admitting requests for the models about to be stopped, and give
+        them a couple of polls to notice"""
+        if self.holding:
+            await self.call(self._announce, evicting)
+            await asyncio.sleep(2 * self.poll_interval)
+
+    def finish(self):
+        """Publish the loaded map after a switch (or a failed one) and hand the switch lease back"""
+        if not self.holding:
+            return
+        self.holding = False
+        loaded = {"loaded": state["loaded"], "current": state["current_model"]}
+        async def publish():
+            self.version = await self.call(self._publish, loaded)
+        spawn(publish())
+
+    def bump_config(self):
+        if not self.path:
+            return
+        async def bump():
+            self.config_version = await self.call(self._bump_config)
+        spawn(bump())
+
+    def totals(self):
+        """Requests in flight and queued per model across all workers"""
+        active, queued = collections.Counter(+lease.active), collections.Counter(lease.queued())
+        for p in self.peers.values():
+            active.update(p["active"])
+            queued.update(p["queued"])
+        return {"workers": len(self.peers) + 1, "active": dict(+active), "queued": dict(+queued)}
+
+coordinator = Coordinator(COORDINATION)
+
+class Rejected(Exception):
+    def __init__(self, message, retry_after):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+class Limiter:
+    """Concurrency slots with a bounded wait queue served in priority order (lower first, then FIFO)"""
+    def __init__(self, name, capacity, queue_size, timeout):
+        self.name, self.capacity, self.queue_size, self.timeout = name, capacity, queue_size, timeout
+        self.active = 0
+        self.waiting = []  # heap of (priority, seq, future)
+        self.seq = 0
+
+    def full(self):
+        return self.active >= self.capacity and len(self.waiting) >= self.queue_size
+
+    def resize(self, capacity):
+        self.capacity = capacity
+        while self.active < self.capacity and self.waiting:
+            _, _, future = heapq.heappop(self.waiting)
+            if not future.done():
+                self.active += 1
+                future.set_result(None)
+
+    async def acquire(self, priority):
+        if self.active < self.capacity and not self.waiting:
+            self.active += 1
+            return
+        if len(self.waiting) >= self.queue_size:
+            raise Rejected(f"{self.name} queue is full", ADMISSION.get("retry_after", 5))
+        future = asyncio.get_running_loop().create_future()
+        self.seq += 1
+        heapq.heappush(self.waiting, (priority, self.seq, future))
+        try:
+            await asyncio.wait_for(asyncio.shield(future), self.timeout)
+        except (asyncio.TimeoutError, asyncio.CancelledError) as e:
+            if future.done():
+                self.release()  # the slot was handed over just as we gave up
+            else:
+                future.cancel()
+                self.waiting = [w for w in self.waiting if w[2] is not future]
+                heapq.heapify(self.waiting)
+            if isinstance(e, asyncio.TimeoutError):
+                raise Rejected(f"Timed out after {self.timeout}s waiting for {self.name}", ADMISSION.get("retry_after", 5)) from None
+            raise
+
+    def release(self):
+        # Hand the slot straight to the next waiter so no newcomer can jump the queue
+        while self.waiting and self.active <= self.capacity:
+            _, _, future = heapq.heappop(self.waiting)
+            if not future.done():
+                future.set_result(None)
+                return
+        self.active -= 1
+
+class Admission:
+    """Per-model (`max_concurrency` on the model) and per-backend (`max_concurrency` on the backend)
+    concurrency limits. TabbyAPI models default to their max_batch_size. Requests over the limit wait
+    up to `admission.queue_timeout` seconds in a queue of at most `admission.queue_size` (per-entry
+    `max_queue` overrides); a full queue or a timeout is a 429 with Retry-After."""
+    def __init__(self, cfg):
+        self.limiters = {}
+        self.configure(cfg)
+
+    def configure(self, cfg):
+        """(Re)build the limiters from MODELS and BACKENDS; a limiter that still exists keeps its
+        holders and queue and is only resized"""
+        self.queue_size = cfg.get("queue_size", 32)
+        self.timeout = cfg.get("queue_timeout", 60)
+        self.header = cfg.get("priority_header", "X-Priority")
+        self.priorities = cfg.get("priorities", {"high": 0, "normal": 1, "low": 2})
+        limiters = {}
+        for name, entry in [*MODELS.items(), *BACKENDS.items()]:
+            capacity = entry.get("max_concurrency")
+            if capacity is None and entry.get("backend") == "tabbyapi":
+                capacity = entry.get("max_batch_size", 1)
+            if capacity:
+                limiter = limiters[name] = self.limiters.get(name) or Limiter(name, capacity, 0, 0)
+                limiter.queue_size, limiter.timeout = entry.get("max_queue", self.queue_size), self.timeout
+                limiter.resize(capacity)
+        self.limiters = limiters
+
+    def chain(self, model):
+        return [self.limiters[n] for n in (model, MODELS.get(model, {}).get("backend")) if n in self.limiters]
+
+    def priority(self, request):
+        value = request.headers.get(self.header, "normal")
+        if value.lstrip("-").isdigit():
+            return int(value)
+        return self.priorities.get(value.lower(), self.priorities.get("normal", 1))
+
+    def check(self, model):
+        """Fail fast (before any response is started) when a queue the request needs is full"""
+        for limiter in self.chain(model):
+            if limiter.full():
+                raise Rejected(f"{limiter.name} queue is full", ADMISSION.get("retry_after", 5))
+
+    async def acquire(self, model, priority, backend=False):
+        """Take a slot on model's limiter, or with backend=True on its backend's; returns what was taken
+        for release(). The backend slot is taken only once the model's lease is held, so requests
+        queued for a cold model don't use up backend capacity that the loaded model needs."""
+        limiter = self.limiters.get(MODELS.get(model, {}).get("backend") if backend else model)
+        if limiter is None:
+            return []
+        await limiter.acquire(priority)
+        return [limiter]
+
+    @staticmethod
+    def release(held):
+        for limiter in held:
+            limiter.release()
+
+admission = Admission(ADMISSION)
+
+# The current routing table's pooled HTTP client per backend
+clients = {}
+
+def backend_url(backend, backends=None):
+    cfg = (BACKENDS if backends is None else backends).get(backend, {})
+    return f"http://{cfg.get('host', 'localhost')}:{cfg.get('port', DEFAULT_PORTS[backend])}"
+
+def make_client(backend, base_url=None, backends=None):
+    """Build a keep-alive client for a backend (or one of its replicas) from its `backends` config entry"""
+    cfg = (BACKENDS if backends is None else backends).get(backend, {})
+    limits = httpx.Limits(
+        max_connections=cfg.get("max_connections", 100),
+        max_keepalive_connections=cfg.get("max_keepalive_connections", 20),
+        keepalive_expiry=cfg.get("keepalive_expiry", 30.0))
+    timeout = httpx.Timeout(
+        connect=cfg.get("connect_timeout", 5.0),
+        read=cfg.get("read_timeout", 300.0),
+        write=cfg.get("write_timeout", 30.0),
+        pool=cfg.get("pool_timeout", 30.0))
+    return httpx.AsyncClient(base_url=base_url or backend_url(backend, backends), limits=limits, timeout=timeout,
+                             headers=cfg.get("headers"))
+
+class Replica:
+    def __init__(self, url, client):
+        self.url, self.client = url, client
+        self.outstanding = 0
+        self.down_until = 0.0
 
-# Global state
-state = {"current_model": None}
-switching_lock = asyncio.Lock()
+class ReplicaRouter:
+    """Spreads a model's requests over its replica endpoints (`replicas` on the model or its backend).
 
-def create_sse(data): return f"data: {json.dumps(data)}\n\n"
+    The leading part of each conversation (the system prompt and the first user message, which
+    every later turn repeats unchanged, or the first `affinity.prefix_chars` of a prompt) is hashed
+    and remembered with the replica that served it, so follow-up turns land where that prefix is
+    already in the KV cache.
+    Unknown prefixes, and replicas more than `affinity.max_skew` requests busier than the least
+    loaded one, fall back to least-outstanding-requests. A replica that fails to connect is skipped
+    for `affinity.down_seconds` and the request is retried once on another replica. The model's backend service and its readiness are still managed
+    through the primary (backend) endpoint; extra replicas are expected to be run alongside it.
+    """
+    def __init__(self, cfg, routes):
+        self.routes = routes
+        self.prefix_chars = cfg.get("prefix_chars", 2048)
+        self.max_skew = cfg.get("max_skew", 8)
+        self.down_seconds = cfg.get("down_seconds", 5.0)
+        self.table_size = cfg.get("table_size", 10000)
+        self.table = collections.OrderedDict()  # (model, prefix hash) -> Replica
+        self.sets = {}  # model -> [Replica]
+        self.own = {}   # replica url -> client opened here
+        self.turn = 0   # rotates ties between equally loaded replicas
+
+    def urls(self, model):
+        info = self.routes.models[model]
+        backend = self.routes.backends.get(info["backend"], {})
+        urls = []
+        for r in info.get("replicas") or backend.get("replicas") or []:
+            if isinstance(r, int):
+                r = f"{backend.get('host', 'localhost')}:{r}"
+            elif isinstance(r, dict):
+                r = f"{r.get('host', backend.get('host', 'localhost'))}:{r['port']}"
+            urls.append(r if "://" in r else f"http://{r}")
+        return urls
+
+    def open(self, previous=None):
+        """Build the replica sets; replicas (and their clients, load and affinity) that `previous`
+        already had with the same backend settings carry over"""
+        carried = {}
+        if previous:
+            for rs in previous.sets.values():
+                for r in rs:
+                    carried[r.url] = r
+        for model, info in self.routes.models.items():
+            urls = self.urls(model)
+            if len(urls) < 2:
+                continue
+            backend = info["backend"]
+            primary = self.routes.urls[backend]
+            same = previous is not None and previous.routes.backends.get(backend) == self.routes.backends.get(backend)
+            replicas = []
+            for url in urls:
+                old = carried.get(url) if same else None
+                if url == primary:
+                    client = self.routes.clients[backend]
+                elif old and url in previous.own:
+                    client = self.own.setdefault(url, old.client)
+                else:
+                    client = self.own.get(url) or self.own.setdefault(url, make_client(backend, url, self.routes.backends))
+                replicas.append(old if old and old.client is client else Replica(url, client))
+            self.sets[model] = replicas
+            logger.info(f"{model}: {len(replicas)} replicas {[r.url for r in replicas]}")
+        if previous:
+            self.table.update((k, r) for k, r in previous.table.items() if r in self.sets.get(k[0], ()))
+
+    def prefix(self, body):
+        messages = body.get("messages")
+        if messages:
+            # Up to and including the first user message: a later turn only appends to the conversation
+            end = next((i for i, m in enumerate(messages) if m.get("role") == "user"), len(messages) - 1)
+            return json.dumps(messages[:end + 1], sort_keys=True)
+        prompt = body.get("prompt")
+        if isinstance(prompt, str) and prompt:
+            return prompt[:self.prefix_chars]
+        return None
+
+    def pick(self, model, body):
+        """The replica to send body to, or None when the model has a single endpoint"""
+        replicas = self.sets.get(model)
+        if not replicas:
+            return None
+        now = time.monotonic()
+        up = [r for r in replicas if r.down_until <= now] or replicas
+        self.turn = (self.turn + 1) % len(up)
+        least = min(up[self.turn:] + up[:self.turn], key=lambda r: r.outstanding)
+        prefix = self.prefix(body)
+        if prefix is None:
+            REPLICA_REQUESTS.inc(model, least.url, "none")
+            return least
+        key = (model, hashlib.blake2b(prefix.encode(), digest_size=8).digest())
+        held = self.table.get(key)
+        if held in up and held.outstanding - least.outstanding <= self.max_skew:
+            self.table.move_to_end(key)
+            REPLICA_REQUESTS.inc(model, held.url, "hit")
+            return held
+        self.table[key] = least
+        self.table.move_to_end(key)
+        if len(self.table) > self.table_size:
+            self.table.popitem(last=False)
+        REPLICA_REQUESTS.inc(model, least.url, "miss")
+        return least
+
+    @asynccontextmanager
+    async def use(self, model, body):
+        """Client for one request to model, counted against the chosen replica while it runs"""
+        replica = self.pick(model, body)
+        if replica is None:
+            yield self.routes.clients[self.routes.models[model]["backend"]]
+            return
+        replica.outstanding += 1
+        try:
+            yield replica.client
+        except (httpx.ConnectError, httpx.ConnectTimeout):
+            self.failed(replica)
+            raise
+        finally:
+            replica.outstanding -= 1
+
+    async def stream(self, stack, model, body, method, path, **kwargs):
+        """Open client.stream() for one request to model on stack, returning (client, response). When the
+        chosen replica refuses the connection the request is sent once more to another replica that is up"""
+        for attempt in range(2):
+            try:
+                async with AsyncExitStack() as opening:
+                    c = await opening.enter_async_context(self.use(model, body))
+                    r = await opening.enter_async_context(c.stream(method, path, **kwargs))
+                    stack.push_async_exit(opening.pop_all())
+                    return c, r
+            except (httpx.ConnectError, httpx.ConnectTimeout):
+                if attempt or not self.spare(model):
+                    raise
+                logger.info(f"Retrying {model} request on another replica")
+
+    def spare(self, model):
+        """Whether model has a replica that is not marked down"""
+        now = time.monotonic()
+        return any(r.down_until <= now for r in self.sets.get(model, ()))
+
+    def failed(self, replica):
+        replica.down_until = time.monotonic() + self.down_seconds
+        logger.warning(f"Replica {replica.url} unreachable; skipping it for {self.down_seconds}s")
+
+Route = collections.namedtuple("Route", "backend url endpoints native_generate abort_endpoint stream_usage cache fallback")
+
+class ConfigError(ValueError):
+    pass
+
+client_refs = collections.Counter()  # pooled client -> routing tables using it
+in_flight = collections.Counter()  # model -> requests routed to it that have not finished, across tables
+
+class RoutingTable:
+    """One validated version of the `models`, `backends` and `affinity` config, with what a request
+    needs precomputed per model (a Route: backend URL, endpoints, /generate fast path, abort API,
+    usage and cache flags) and the pooled clients to reach it (backend `headers` are set on them).
+
+    A table is never modified: a config reload builds a new one and swaps `routing`. Requests take
+    the current table on arrival (checkout) and give it back when they finish, so in-flight requests
+    keep the URLs and clients they started with. A replaced table closes the clients its successor
+    did not take over once its last request is done.
+    """
+    def __init__(self, models, backends, affinity):
+        self.models = types.MappingProxyType(models)
+        self.backends = types.MappingProxyType(backends)
+        self.urls = {b: backend_url(b, backends) for b in DEFAULT_PORTS}
+        self.routes = types.MappingProxyType({m: self.route(info) for m, info in models.items()})
+        self.clients = {}
+        self.replicas = ReplicaRouter(affinity, self)
+        self.users = 0
+        self.retired = False
+
+    def route(self, info):
+        backend = info.get("backend")
+        cfg = self.backends.get(backend, {})
+        native = info.get("native_generate", cfg.get("native_generate", False))
+        if native and not cfg.get("incremental_output", False):
+            # Cumulative /generate events grow with the output, so relaying them costs quadratic CPU
+            logger.warning(f"{info.get('model_path')}: native_generate needs incremental_output (SGLang "
+                           f"--incremental-streaming-output); using the OpenAI endpoint")
+            native = False
+        return Route(backend, self.urls.get(backend), frozenset(cfg.get("endpoints", DEFAULT_ENDPOINTS)), native,
+                     cfg.get("abort_endpoint", "/abort_request" if backend == "sglang" else None),
+                     cfg.get("stream_usage", True), bool(info.get("cache")), tuple(info.get("fallback", ())))
+
+    @staticmethod
+    def validate(config):
+        """Raise ConfigError listing what is wrong with a config.json document"""
+        problems = []
+        models, backends = config.get("models"), config.get("backends", {})
+        if not isinstance(backends, dict):
+            problems.append("`backends` must be an object")
+            backends = {}
+        for name, cfg in backends.items():
+            if name not in DEFAULT_PORTS:
+                problems.append(f"unknown backend {name!r}")
+            elif not isinstance(cfg, dict):
+                problems.append(f"backend {name}: must be an object")
+            elif not isinstance(cfg.get("port", 0), int) or not isinstance(cfg.get("headers", {}), dict) \
+                    or not isinstance(cfg.get("endpoints", []), list):
+                problems.append(f"backend {name}: `port` must be an integer, `headers` an object and `endpoints` a list")
+        if not isinstance(models, dict) or not models:
+            problems.append("`models` must be a non-empty object")
+            models = {}
+        for model, info in models.items():
+            if not isinstance(info, dict):
+                problems.append(f"model {model}: must be an object")
+                continue
+            if info.get("backend") not in DEFAULT_PORTS:
+                problems.append(f"model {model}: unknown backend {info.get('backend')!r}")
+            if not info.get("model_path"):
+                problems.append(f"model {model}: `model_path` is required")
+            footprint = info.get("footprint", {})
+            if not isinstance(footprint, dict) or not all(isinstance(v, (int, float)) for v in footprint.values()):
+                problems.append(f"model {model}: `footprint` must map resource pools to numbers")
+            if "max_concurrency" in info and not (isinstance(info["max_concurrency"], int) and info["max_concurrency"] > 0):
+                problems.append(f"model {model}: `max_concurrency` must be a positive integer")
+            if not isinstance(info.get("replicas", []), list):
+                problems.append(f"model {model}: `replicas` must be a list")
+            fallback = info.get("fallback", [])
+            if not isinstance(fallback, list) or any(f != "*" and f not in models for f in fallback):
+                problems.append(f"model {model}: `fallback` must list configured models or \"*\"")
+        if problems:
+            raise ConfigError("; ".join(problems))
+
+    def open(self, previous=None):
+        """Create the pooled clients, taking over those of `previous` whose backend settings are unchanged"""
+        for backend in DEFAULT_PORTS:
+            if previous and previous.backends.get(backend) == self.backends.get(backend):
+                self.clients[backend] = previous.clients[backend]
+            else:
+                self.clients[backend] = make_client(backend, self.urls[backend], self.backends)
+        self.replicas.open(previous and previous.replicas)
+        client_refs.update(self.owned())
+
+    def owned(self):
+        return {*self.clients.values(), *self.replicas.own.values()}
+
+    def checkout(self, model):
+        self.users += 1
+        in_flight[model] += 1
+        return self
+
+    def release(self, model):
+        self.users -= 1
+        in_flight[model] -= 1
+        if self.retired and not self.users:
+            spawn(self.close())
+
+    def retire(self):
+        self.retired = True
+        if not self.users:
+            spawn(self.close())
+
+    async def close(self):
+        for c in self.owned():
+            client_refs[c] -= 1
+            if not client_refs[c]:
+                del client_refs[c]
+                await c.aclose()
+
+routing = RoutingTable(MODELS, BACKENDS, AFFINITY)
+try:
+    RoutingTable.validate(config)
+except ConfigError as e:
+    logger.warning(f"Config problems: {e}")
+
+background_tasks = set()
+
+def spawn(coro):
+    """Run coro in the background, keeping a reference until it is done"""
+    task = asyncio.create_task(coro)
+    background_tasks.add(task)
+    task.add_done_callback(background_tasks.discard)
+    return task
+
+RELOADABLE = ("models", "backends", "affinity", "admission", "scheduler", "placement")
+reload_lock = asyncio.Lock()
+
+async def reload_config(reason):
+    """Re-read config.json, validate it and swap in a new routing table; the running config stays
+    in place (ConfigError) if the file is unreadable or invalid. Settings outside RELOADABLE
+    need a restart. Returns a summary of what changed."""
+    global config, routing, MODELS, BACKENDS, SGLANG_PORT, TABBY_PORT, LLAMACPP_PORT, AFFINITY, ADMISSION, SCHEDULER, PLACEMENT
+    async with reload_lock:
+        try:
+            new = json.loads(await asyncio.to_thread(read_file, CONFIG_FILE))
+        except (OSError, ValueError) as e:
+            raise ConfigError(f"Cannot read {CONFIG_FILE}: {e}") from None
+        if not isinstance(new, dict):
+            raise ConfigError(f"{CONFIG_FILE} must contain a JSON object")
+        RoutingTable.validate(new)
+        busy = [m for m in MODELS if m not in new["models"] and (in_flight[m] or lease.active[m] or m in background_switches)]
+        if busy:
+            raise ConfigError(f"Cannot remove {', '.join(busy)} while requests for it are in flight")
+        table = RoutingTable(new["models"], new.get("backends", {}), new.get("affinity", {}))
+        table.open(routing)
+        old, routing = routing, table
+        MODELS, BACKENDS = new["models"], new.get("backends", {})
+        SGLANG_PORT, TABBY_PORT, LLAMACPP_PORT = (BACKENDS.get(b, {}).get("port", p) for b, p in DEFAULT_PORTS.items())
+        AFFINITY, ADMISSION = new.get("affinity", {}), new.get("admission", {})
+        SCHEDULER, PLACEMENT = new.get("scheduler", {}), new.get("placement", {})
+        clients.clear()
+        clients.update(table.clients)
+        admission.configure(ADMISSION)
+        lease.policy = make_policy(SCHEDULER)
+        lease.placement.capacity = PLACEMENT.get("resources", {})
+        lease.placement.eviction = PLACEMENT.get("eviction", "lru")
+        chat_templates.clear()
+        old.retire()
+        summary = {"models": list(MODELS),
+                   "added": [m for m in MODELS if m not in old.models],
+                   "removed": [m for m in old.models if m not in MODELS],
+                   "changed": [m for m in MODELS if m in old.models and old.models[m] != MODELS[m]],
+                   "restart_required": sorted(k for k in {*config, *new} if k not in RELOADABLE and config.get(k) != new.get(k))}
+        config = new
+    if reason != "peer":
+        coordinator.bump_config()
+    logger.info(f"Reloaded config ({reason}): +{summary['added']} -{summary['removed']} ~{summary['changed']}")
+    if summary["restart_required"]:
+        logger.warning(f"Restart the router to apply {summary['restart_required']}")
+    return summary
+
+async def reload_quietly(reason):
+    try:
+        await reload_config(reason)
+    except ConfigError as e:
+        logger.error(f"Config reload ({reason}) rejected, keeping the running config: {e}")
+
+async def watch_config():
+    """Reload when config.json changes (`config_watch_interval` seconds between checks)"""
+    def stamp():
+        try:
+            st = os.stat(CONFIG_FILE)
+            return st.st_mtime_ns, st.st_size
+        except OSError:
+            return None
+    last = stamp()
+    while True:
+        await asyncio.sleep(CONFIG_WATCH_INTERVAL)
+        current = stamp()
+        if current and current != last:
+            last = current
+            await reload_quietly("file changed")
+
+@asynccontextmanager
+async def lifespan(app):
+    routing.open()
+    clients.update(routing.clients)
+    request_log.open()
+    await coordinator.open()
+    prewarmer.start()
+    loop = asyncio.get_running_loop()
+    loop.add_signal_handler(signal.SIGHUP, lambda: spawn(reload_quietly("SIGHUP")))
+    watcher = asyncio.create_task(watch_config()) if CONFIG_WATCH_INTERVAL else None
+    yield
+    loop.remove_signal_handler(signal.SIGHUP)
+    if watcher:
+        watcher.cancel()
+    await prewarmer.stop()
+    await coordinator.close()
+    request_log.close()
+    await routing.close()
+    clients.clear()
+
+app = FastAPI(title="Multi-Backend LLM Router", version="4.0.0", lifespan=lifespan)
+
+def create_sse(data): return b"data: " + dumps(data) + b"\n\n"
+
+SSE_DONE = b"data: [DONE]\n\n"
+# Prebuilt frames for router-generated text: only the text itself is encoded per frame
+CONTENT_FRAMES = {True: (b'data: {"choices":[{"delta":{"content":', b'}}]}\n\n'),
+                  False: (b'data: {"choices":[{"text":', b'}]}\n\n')}
+
+def content_sse(text, path="/v1/chat/completions", finish_reason=None):
+    """Router-generated text (status lines, performance footer) framed for the endpoint's chunk format"""
+    chat = path.endswith("/chat/completions")
+    if finish_reason:
+        choice = {"delta": {"content": text}} if chat else {"text": text}
+        return create_sse({"choices": [{**choice, "finish_reason": finish_reason}]})
+    head, tail = CONTENT_FRAMES[chat]
+    return head + dumps(text) + tail
+
+# Prometheus metrics (text exposition format, no client library needed)
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+SWITCH_BUCKETS = (0.5, 1, 2, 5, 10, 20, 30, 60, 120, 180, 300, 600)
+
+# Label values can be client-supplied (model names): escape \, " and newline as the text format requires
+LABEL_ESCAPES = str.maketrans({"\\": "\\\\", '"': '\\"', "\n": "\\n"})
+
+def format_labels(names, values):
+    return ",".join(f'{n}="{str(v).translate(LABEL_ESCAPES)}"' for n, v in zip(names, values))
+
+class MetricCounter:
+    def __init__(self, name, help, labels=()):
+        self.name, self.help, self.labels = name, help, labels
+        self.values = collections.defaultdict(float)
+
+    def inc(self, *labels, amount=1):
+        self.values[labels] += amount
+
+    def render(self):
+        yield f"# HELP {self.name} {self.help}\n# TYPE {self.name} counter"
+        for labels, v in self.values.items():
+            yield f"{self.name}{{{format_labels(self.labels, labels)}}} {v}"
+
+class Histogram:
+    """Bucket counts are kept per bucket and only made cumulative when scraped,
+    so observe() is a bisect and two additions"""
+    def __init__(self, name, help, labels=(), buckets=LATENCY_BUCKETS):
+        self.name, self.help, self.labels, self.buckets = name, help, labels, buckets
+        self.series = {}  # labels -> [bucket counts..., +Inf count, sum]
+
+    def observe(self, value, *labels):
+        series = self.series.get(labels)
+        if series is None:
+            series = self.series[labels] = [0] * (len(self.buckets) + 2)
+        series[bisect.bisect_left(self.buckets, value)] += 1
+        series[-1] += value
+
+    def render(self):
+        yield f"# HELP {self.name} {self.help}\n# TYPE {self.name} histogram"
+        for labels, series in self.series.items():
+            base = format_labels(self.labels, labels)
+            sep = "," if base else ""
+            total = 0
+            for le, n in zip((*self.buckets, "+Inf"), series):
+                total += n
+                yield f'{self.name}_bucket{{{base}{sep}le="{le}"}} {total}'
+            yield f"{self.name}_sum{{{base}}} {series[-1]}"
+            yield f"{self.name}_count{{{base}}} {total}"
+
+REQUESTS = MetricCounter("router_requests_total", "Completed requests by model and outcome", ("model", "status"))
+OUTPUT_TOKENS = MetricCounter("router_output_tokens_total", "Generated tokens by model", ("model",))
+BACKEND_ERRORS = MetricCounter("router_backend_errors_total", "Failed backend calls or error responses", ("backend",))
+ABORTED = MetricCounter("router_aborted_streams_total", "Streams closed by the client before completion", ("model",))
+TTFT = Histogram("router_time_to_first_token_seconds", "Time from proxying a request to its first token", ("model",))
+ITL = Histogram("router_inter_token_seconds", "Time between streamed chunks carrying tokens", ("model",))
+LATENCY = Histogram("router_request_duration_seconds", "Total generation time, excluding model switches", ("model",))
+SWITCHES = Histogram("router_model_switch_seconds", "Model switch duration by phase (stop, start, ready)", ("model", "phase"), SWITCH_BUCKETS)
+REPLICA_REQUESTS = MetricCounter("router_replica_requests_total", "Requests per replica by prefix-affinity outcome (hit, miss, none)", ("model", "replica", "affinity"))
+PREWARMS = MetricCounter("router_prewarm_total", "Background model loads by trigger (predicted, admin)", ("model", "trigger"))
+PREDICTIONS = MetricCounter("router_prewarm_predictions_total", "Whether the request after a predicted preload was for that model", ("outcome",))
+FALLBACKS = MetricCounter("router_fallback_total", "Requests for a cold model answered by a warm fallback model", ("model", "served"))
+CACHE_LOOKUPS = MetricCounter("router_response_cache_total", "Response cache lookups and stores (hit_memory, hit_disk, miss, store)", ("model", "result"))
+BACKEND_ABORTS = MetricCounter("router_backend_aborts_total", "Abort API calls for generations whose client disconnected", ("backend", "outcome"))
+METRICS = (REQUESTS, OUTPUT_TOKENS, BACKEND_ERRORS, ABORTED, TTFT, ITL, LATENCY, SWITCHES, REPLICA_REQUESTS, PREWARMS, PREDICTIONS,
+           FALLBACKS, CACHE_LOOKUPS, BACKEND_ABORTS)
+
+# Max upstream chunks buffered per stream before the backend read is paused
+STREAM_QUEUE_SIZE = 64
+DISCONNECT_POLL_INTERVAL = 0.5
+JSON_HEADERS = {"Content-Type": "application/json"}
+# Byte scans of unparsed events. Quotes inside JSON strings are escaped, so these only match keys.
+METRICS_EVENT = re.compile(rb'"(?:usage|timings)"\s*:\s*\{')
+GENERATED_TEXT = re.compile(rb'"(?:content|reasoning_content|text)"\s*:\s*"[^"]')
+
+class SSEParser:
+    """Incremental text/event-stream parser: feed raw bytes, get back the data of each complete event.
+
+    Works on bytes throughout: event boundaries and `data:` prefixes are ASCII,
+    so multi-byte characters split across network chunks are reassembled
+    without decoding, and events can be forwarded without a decode/encode trip.
+    Each byte is searched for a boundary once and an event's data is copied
+    once, so large events spread over many chunks cost no more than small ones.
+    """
+    def __init__(self):
+        self._buf = bytearray()
+        self._cr = False  # the last chunk ended in \r, which may pair with a \n at the start of the next
+
+    def feed(self, chunk):
+        if self._cr:
+            chunk, self._cr = b"\r" + chunk, False
+        if b"\r" in chunk:
+            if chunk.endswith(b"\r"):
+                chunk, self._cr = chunk[:-1], True
+            chunk = chunk.replace(b"\r\n", b"\n").replace(b"\r", b"\n")
+        buf = self._buf
+        scan = max(len(buf) - 1, 0)  # what was buffered holds no boundary, except one straddling its end
+        buf += chunk
+        events, start = [], 0
+        with memoryview(buf) as view:
+            while (end := buf.find(b"\n\n", scan)) >= 0:
+                if buf.find(b"\n", start, end) < 0:  # a single line, the usual case
+                    if buf.startswith(b"data:", start):
+                        events.append(bytes(view[start + 6 if buf.startswith(b"data: ", start) else start + 5:end]))
+                else:
+                    data = [line[6:] if line.startswith(b"data: ") else line[5:]
+                            for line in bytes(view[start:end]).split(b"\n") if line.startswith(b"data:")]
+                    if data:
+                        events.append(b"\n".join(data))
+                start = scan = end + 2
+        del buf[:start]
+        return events
+
+# Lazily loaded tokenizers, only used when a backend reports no usage at all
+tokenizers = {}
+
+def get_tokenizer(model):
+    """Load (once) the tokenizer.json next to a model, or from its `tokenizer_path`; None if unavailable"""
+    if model not in tokenizers:
+        tok = None
+        info = MODELS.get(model, {})
+        path = info.get("tokenizer_path") or info.get("model_path", "")
+        if os.path.isdir(path):
+            path = os.path.join(path, "tokenizer.json")
+        try:
+            if path.endswith(".json") and os.path.isfile(path):
+                from tokenizers import Tokenizer
+                tok = Tokenizer.from_file(path)
+                logger.info(f"Loaded tokenizer for {model} from {path}")
+        except Exception as e:
+            logger.warning(f"Could not load tokenizer for {model} from {path}: {e}")
+        tokenizers[model] = tok
+    return tokenizers[model]
+
+# Chat templates for backends fed raw prompts, compiled once per model
+chat_templates = {}
+TEMPLATE_CACHE_SIZE = 64
+
+class ChatTemplateError(Exception):
+    pass
+
+def raise_template_error(message):
+    raise ChatTemplateError(message)
+
+class ChatTemplate:
+    """A model's Jinja chat template, compiled once.
+
+    Rendering streams the template's output chunks into a single join. Each render covers the
+    whole conversation, since a Jinja template cannot resume from an earlier turn's output; only
+    exact repeats are cached, in a small LRU (retries and regenerations re-send the same
+    conversation). Whether the template
+    is prefix-stable, i.e. turn N's prompt starts with turn N-1's, is checked at compile time:
+    that is what lets the backend's prefix cache reuse the previous turn's KV.
+    """
+    def __init__(self, source, bos_token="", eos_token=""):
+        from jinja2.sandbox import ImmutableSandboxedEnvironment
+        env = ImmutableSandboxedEnvironment(trim_blocks=True, lstrip_blocks=True, extensions=["jinja2.ext.loopcontrols"])
+        env.filters["tojson"] = lambda value, ensure_ascii=False, indent=None, separators=None, sort_keys=False: json.dumps(
+            value, ensure_ascii=ensure_ascii, indent=indent, separators=separators, sort_keys=sort_keys)
+        env.globals["raise_exception"] = raise_template_error
+        env.globals["strftime_now"] = time.strftime
+        self.template = env.from_string(source)
+        self.bos_token, self.eos_token = bos_token, eos_token
+        self.rendered = collections.OrderedDict()
+        self.prefix_stable = self.check_prefix_stable()
+
+    def render(self, messages, add_generation_prompt=True, **kwargs):
+        key = json.dumps([messages, add_generation_prompt, kwargs], sort_keys=True)
+        if key in self.rendered:
+            self.rendered.move_to_end(key)
+            return self.rendered[key]
+        text = "".join(self.template.generate(messages=messages, add_generation_prompt=add_generation_prompt,
+                                              bos_token=self.bos_token, eos_token=self.eos_token, **kwargs))
+        self.rendered[key] = text
+        if len(self.rendered) > TEMPLATE_CACHE_SIZE:
+            self.rendered.popitem(last=False)
+        return text
+
+    def check_prefix_stable(self):
+        turns = [{"role": "system", "content": "s"}, {"role": "user", "content": "u1"},
+                 {"role": "assistant", "content": "a1"}, {"role": "user", "content": "u2"}]
+        try:
+            first = "".join(self.template.generate(messages=turns[:2], add_generation_prompt=True,
+                                                   bos_token=self.bos_token, eos_token=self.eos_token))
+            second = "".join(self.template.generate(messages=turns, add_generation_prompt=True,
+                                                    bos_token=self.bos_token, eos_token=self.eos_token))
+        except Exception:
+            return False
+        return second.startswith(first)
+
+def special_token(value):
+    return value.get("content", "") if isinstance(value, dict) else (value or "")
+
+def get_chat_template(model):
+    """Load (once) the model's chat template: `chat_template` (a .jinja path) in its config, else
+    chat_template.jinja / chat_template.json / tokenizer_config.json in model_path; None if unavailable"""
+    if model not in chat_templates:
+        template = None
+        info = MODELS.get(model, {})
+        path = info.get("model_path", "")
+        try:
+            source, tokens = None, {}
+            config_path = os.path.join(path, "tokenizer_config.json")
+            if os.path.isfile(config_path):
+                tokens = json.load(open(config_path))
+                source = tokens.get("chat_template")
+                if isinstance(source, list):  # named templates; the default one is for plain chat
+                    source = next((t["template"] for t in source if t.get("name") == "default"), None)
+            if os.path.isfile(os.path.join(path, "chat_template.json")):
+                source = json.load(open(os.path.join(path, "chat_template.json"))).get("chat_template", source)
+            for jinja_path in (os.path.join(path, "chat_template.jinja"), info.get("chat_template")):
+                if jinja_path and os.path.isfile(jinja_path):
+                    source = open(jinja_path).read()
+            if source:
+                template = ChatTemplate(source, special_token(tokens.get("bos_token")), special_token(tokens.get("eos_token")))
+                logger.info(f"Compiled chat template for {model}" + ("" if template.prefix_stable else
+                            " (not prefix-stable: follow-up turns will miss the backend prefix cache)"))
+        except Exception as e:
+            logger.warning(f"Could not load chat template for {model} from {path}: {e}")
+        chat_templates[model] = template
+    return chat_templates[model]
+
+class StreamStats:
+    """Token and latency accounting for one streamed completion.
+
+    Prefers the backend's final `usage` chunk and llama.cpp's `timings`;
+    only falls back to counting the streamed text (or, for events that were
+    never parsed, the events that carried text) when neither arrives.
+    """
+    def __init__(self, model):
+        self.model = model
+        self.start = time.time()
+        self.first_token = None
+        self.end = None
+        self.usage = None
+        self.timings = None
+        self.pieces = []
+        self.chunks = 0
+        self.last_token = None
+
+    def tick(self, now):
+        """Account one event known to carry generated text without parsing it"""
+        if self.first_token is None:
+            self.first_token = now
+        else:
+            ITL.observe(now - self.last_token, self.model)
+        self.last_token = now
+        self.chunks += 1
+
+    def observe(self, chunk_data, now):
+        """Account one parsed event; now is when its network chunk arrived"""
+        if chunk_data.get("usage"):
+            self.usage = chunk_data["usage"]
+        if chunk_data.get("timings"):
+            self.timings = chunk_data["timings"]
+        choices = chunk_data.get("choices")
+        if choices:
+            delta = choices[0].get("delta") or {}
+            text = delta.get("content") or delta.get("reasoning_content") or choices[0].get("text")
+            if text:
+                self.tick(now)
+                self.pieces.append(text)
+
+    async def finish(self):
+        """Close the measurement and return a summary dict (None if nothing was generated)"""
+        self.end = time.time()
+        ttft = (self.first_token or self.end) - self.start
+        prompt_tokens = None
+        if self.timings and self.timings.get("predicted_n"):
+            tokens, source = self.timings["predicted_n"], "timings"
+            prompt_tokens = self.timings.get("prompt_n")
+        elif self.usage and self.usage.get("completion_tokens"):
+            tokens, source = self.usage["completion_tokens"], "usage"
+            prompt_tokens = self.usage.get("prompt_tokens")
+        elif self.pieces:
+            text = "".join(self.pieces)
+            tok = get_tokenizer(self.model)
+            if tok:
+                tokens, source = len((await asyncio.to_thread(tok.encode, text, add_special_tokens=False)).ids), "tokenizer"
+            else:
+                tokens, source = max(1, len(text) // 4), "estimate"
+        elif self.chunks:
+            tokens, source = self.chunks, "chunks"
+        else:
+            return None
+        OUTPUT_TOKENS.inc(self.model, amount=tokens)
+        TTFT.observe(ttft, self.model)
+        LATENCY.observe(self.end - self.start, self.model)
+        if self.timings and self.timings.get("predicted_ms"):
+            decode_time = self.timings["predicted_ms"] / 1000
+        else:
+            decode_time = self.end - (self.first_token or self.start)
+        if self.timings and self.timings.get("prompt_per_second"):
+            prefill_tps = self.timings["prompt_per_second"]
+        else:
+            prefill_tps = prompt_tokens / ttft if prompt_tokens and ttft > 0 else None
+        return {"tokens": tokens, "source": source, "elapsed": self.end - self.start, "ttft": ttft,
+                "decode_tps": tokens / decode_time if decode_time > 0 else 0.0,
+                "prompt_tokens": prompt_tokens, "prefill_tps": prefill_tps}
+
+class GenerateStream:
+    """Serves a streaming completion from SGLang's native /generate endpoint. Chat requests are
+    rendered with the model's own chat template (get_chat_template) into the raw prompt.
+
+    Only used when SGLang runs with --incremental-streaming-output (`incremental_output` in the
+    backend config), so every event carries just the new text. Without it /generate repeats the
+    whole text so far in each event, and the bytes the router would receive, frame and copy grow
+    quadratically with the output; those requests go to the OpenAI endpoint instead.
+    """
+    SAMPLING = {"temperature": "temperature", "top_p": "top_p", "top_k": "top_k", "min_p": "min_p",
+                "max_tokens": "max_new_tokens", "max_completion_tokens": "max_new_tokens", "stop": "stop", "seed": "sampling_seed",
+                "frequency_penalty": "frequency_penalty", "presence_penalty": "presence_penalty",
+                "repetition_penalty": "repetition_penalty"}
+
+    def __init__(self, model, body, chat=False):
+        self.model, self.body, self.chat = model, body, chat
+        self.id = f"{'chatcmpl' if chat else 'cmpl'}-{os.urandom(12).hex()}"
+        self.object = "chat.completion.chunk" if chat else "text_completion"
+        self.started = False
+        self.created = int(time.time())
+
+    @staticmethod
+    def eligible(model, route, body, path):
+        """Whether the request can take the /generate fast path: a single plain-text prompt, or chat
+        messages with a usable chat template, and nothing that needs the server's OpenAI layer"""
+        if not route.native_generate:
+            return False
+        if body.get("n", 1) != 1 or any(body.get(k) for k in ("echo", "logprobs", "suffix", "best_of")):
+            return False
+        if path == "/v1/completions":
+            return isinstance(body.get("prompt"), str)
+        if path == "/v1/chat/completions":
+            return (not any(body.get(k) for k in ("tools", "tool_choice", "response_format", "top_logprobs"))
+                    and get_chat_template(model) is not None)
+        return False
+
+    def prompt(self):
+        """The raw prompt; raises ChatTemplateError if the template rejects the conversation"""
+        if not self.chat:
+            return self.body["prompt"]
+        template = get_chat_template(self.model)
+        try:
+            text = template.render(self.body.get("messages", []), **(self.body.get("chat_template_kwargs") or {}))
+        except ChatTemplateError:
+            raise
+        except Exception as e:  # jinja2 errors: undefined variables, bad message shapes
+            raise ChatTemplateError(repr(e)) from e
+        # SGLang's tokenizer adds BOS itself; a second one from the template degrades output
+        if template.bos_token and text.startswith(template.bos_token):
+            text = text[len(template.bos_token):]
+        return text
+
+    def request(self):
+        sampling = {dst: self.body[src] for src, dst in self.SAMPLING.items() if self.body.get(src) is not None}
+        return {"text": self.prompt(), "sampling_params": sampling, "stream": True}
+
+    def chunk(self, text, finish_reason=None):
+        if self.chat:
+            delta = {"content": text} if self.started else {"role": "assistant", "content": text}
+            self.started = True
+            choice = {"index": 0, "delta": delta, "finish_reason": finish_reason}
+        else:
+            choice = {"index": 0, "text": text, "finish_reason": finish_reason}
+        return {"id": self.id, "object": self.object, "created": self.created, "model": self.model, "choices": [choice]}
+
+    @staticmethod
+    def parse(data):
+        """Decode one event"""
+        return loads(data)
+
+    def translate(self, event):
+        """OpenAI chunks for one parsed /generate event: the new text, then finish reason and usage at the end"""
+        delta = event.get("text") or ""
+        meta = event.get("meta_info") or {}
+        finish = meta.get("finish_reason")
+        if isinstance(finish, dict):
+            finish = "length" if finish.get("type") == "length" else "stop"
+        out = [self.chunk(delta, finish)] if delta or finish else []
+        if finish and "completion_tokens" in meta:
+            prompt_tokens = meta.get("prompt_tokens", 0)
+            out.append({"id": self.id, "object": self.object, "created": self.created, "model": self.model, "choices": [],
+                        "usage": {"prompt_tokens": prompt_tokens, "completion_tokens": meta["completion_tokens"],
+                                  "total_tokens": prompt_tokens + meta["completion_tokens"]}})
+        return out
+
+async def pump_stream(r, queue):
+    """Copy upstream chunks into queue so the consumer can coalesce whatever piled up while the client was slow"""
+    try:
+        async for chunk in r.aiter_bytes():
+            await queue.put((time.time(), chunk))
+    except asyncio.CancelledError:
+        raise  # cancelled by the consumer, which no longer reads the queue: don't wait for room for the end marker
+    except Exception:
+        await queue.put(None)
+        raise
+    await queue.put(None)
+
+# TabbyAPI credentials, re-read only when api_tokens.yml changes on disk
+tabby_auth = {"path": None, "mtime": None, "headers": {}}
+
+def tabby_headers():
+    """Read TabbyAPI admin key if available (cached by file mtime)"""
+    # Get tokens path from environment or use default
+    api_tokens_path = os.getenv("TABBY_TOKENS_PATH", "/opt/TabbyAPI/api_tokens.yml")
+    try:
+        mtime = os.stat(api_tokens_path).st_mtime_ns
+    except OSError:
+        mtime = None
+    if tabby_auth["path"] == api_tokens_path and tabby_auth["mtime"] == mtime:
+        return tabby_auth["headers"]
+    headers = {}
+    if mtime is not None:
+        try:
+            import yaml
+            with open(api_tokens_path) as f:
+                tokens = yaml.safe_load(f)
+                if tokens and "admin_key" in tokens:
+                    headers["Authorization"] = f"Bearer {tokens['admin_key']}"
+                    logger.info(f"Loaded TabbyAPI auth token from {api_tokens_path}")
+        except Exception as e:
+            logger.warning(f"Could not load TabbyAPI auth token from {api_tokens_path}: {e}")
+    tabby_auth.update(path=api_tokens_path, mtime=mtime, headers=headers)
+    return headers
 
 async def check_health(backend):
     try:
-        port = {"sglang": SGLANG_PORT, "tabbyapi": TABBY_PORT, "llamacpp": LLAMACPP_PORT}[backend]
-        
-        # Read TabbyAPI API key if available
-        headers = {}
-        if backend == "tabbyapi":
+        headers = tabby_headers() if backend == "tabbyapi" else {}
+        c = clients[backend]
+        # Test actual inference capability, not just endpoint availability
+        test_body = {"model": "test", "prompt": "hi", "max_tokens": 1, "stream": False}
+        if backend == "llamacpp":
+            r = await c.post("/v1/completions", json=test_body, headers=headers, timeout=5.0)
+        else:
+            r = await c.post("/v1/chat/completions",
+                json={"model": "test", "messages": [{"role": "user", "content": "hi"}], "max_tokens": 1, "stream": False},
+                headers=headers, timeout=5.0)
+        return r.status_code in [200, 404]  # 404 means server up, just wrong model name
+    except: return False
+
+class HealthCache:
+    """Shares backend probes: concurrent callers await the same in-flight probe per backend,
+    and a result is reused for `ttl` seconds so /health pollers don't add load to a busy backend"""
+    def __init__(self, ttl, probe):
+        self.ttl = ttl
+        self.probe = probe
+        self.results = {}  # backend -> (monotonic time, ok)
+        self.inflight = {}
+
+    async def check(self, backend, max_age=None):
+        max_age = self.ttl if max_age is None else max_age
+        hit = self.results.get(backend)
+        if hit and time.monotonic() - hit[0] <= max_age:
+            return hit[1]
+        task = self.inflight.get(backend)
+        if task is None:
+            task = self.inflight[backend] = asyncio.ensure_future(self._probe(backend))
+        # Shielded so one caller going away doesn't cancel the probe for everyone else
+        return await asyncio.shield(task)
+
+    async def _probe(self, backend):
+        try:
+            ok = await self.probe(backend)
+            self.results[backend] = (time.monotonic(), ok)
+            return ok
+        finally:
+            self.inflight.pop(backend, None)
+
+    def invalidate(self, backend):
+        self.results.pop(backend, None)
+
+# Lines in a backend's journal/log that mean it is (probably) ready; a match just triggers an immediate probe
+READY_PATTERNS = {
+    "sglang": r"fired up and ready to roll",
+    "llamacpp": r"model loaded|all slots are idle|server is listening",
+    "tabbyapi": r"Uvicorn running on|Application startup complete",
+}
+
+async def is_alive(backend):
+    """Cheap liveness probe against the backend's health endpoint before paying for an inference probe"""
+    endpoint = BACKENDS.get(backend, {}).get("health_endpoint")
+    if not endpoint:
+        return True
+    try:
+        r = await clients[backend].get(endpoint, timeout=1.0)
+        return r.status_code == 200
+    except httpx.HTTPError:
+        return False
+
+# Inference probes are for readiness only; /health reports the cheap liveness check
+health_cache = HealthCache(HEALTH_CACHE_TTL, check_health)
+liveness = HealthCache(HEALTH_CACHE_TTL, is_alive)
+
+async def watch_ready_line(backend, woke, since):
+    """Set woke whenever the backend logs a line matching its ready pattern"""
+    pattern = re.compile(BACKENDS.get(backend, {}).get("ready_pattern", READY_PATTERNS.get(backend, "$^")))
+    lines = services.follow(SERVICE_MAP[backend], since, BACKENDS.get(backend, {}).get("log_file"))
+    if lines is None:
+        return
+    async for line in lines:
+        if pattern.search(line):
+            logger.debug(f"{backend} logged ready line: {line.strip()}")
+            woke.set()
+
+async def wait_ready(backend, since=None):
+    """Wait for a backend to serve inference, polling with exponential backoff (tight at first),
+    probing immediately when its log says it is up, and reporting progress every few seconds"""
+    start = time.monotonic()
+    deadline = start + MODEL_LOAD_TIMEOUT
+    woke = asyncio.Event()
+    watcher = asyncio.create_task(watch_ready_line(backend, woke, since or time.time()))
+    interval = READY_MIN_INTERVAL
+    next_poll = start
+    next_progress = start + PROGRESS_INTERVAL
+    try:
+        while (now := time.monotonic()) < deadline:
+            if now >= next_poll or woke.is_set():
+                woke.clear()
+                if await is_alive(backend) and await health_cache.check(backend, max_age=0):
+                    yield {"status": "ready", "elapsed": int(time.monotonic() - start)}
+                    return
+                next_poll = time.monotonic() + interval
+                interval = min(interval * 2, READY_MAX_INTERVAL)
+            if time.monotonic() >= next_progress:
+                yield {"status": "loading", "elapsed": int(time.monotonic() - start)}
+                next_progress += PROGRESS_INTERVAL
             try:
-                import yaml
-                # Get tokens path from environment or use default
-                api_tokens_path = os.getenv("TABBY_TOKENS_PATH", "/opt/TabbyAPI/api_tokens.yml")
-                if os.path.exists(api_tokens_path):
-                    with open(api_tokens_path) as f:
-                        tokens = yaml.safe_load(f)
-                        if tokens and "admin_key" in tokens:
-                            headers["Authorization"] = f"Bearer {tokens['admin_key']}"
-                            logger.debug(f"Loaded TabbyAPI auth token from {api_tokens_path}")
-            except Exception as e:
-                logger.warning(f"Could not load TabbyAPI auth token from {api_tokens_path}: {e}")
-        
-        async with httpx.AsyncClient(timeout=5.0) as c:
-            # Test actual inference capability, not just endpoint availability
-            test_body = {"model": "test", "prompt": "hi", "max_tokens": 1, "stream": False}
-            if backend == "llamacpp":
-                r = await c.post(f"http://localhost:{port}/v1/completions", json=test_body, headers=headers)
+                await asyncio.wait_for(woke.wait(), max(0.0, min(next_poll, next_progress, deadline) - time.monotonic()))
+            except asyncio.TimeoutError:
+                pass
+    finally:
+        watcher.cancel()
+    yield {"status": "timeout"}
+
+def read_file(path):
+    with open(path) as f:
+        return f.read()
+
+def write_file(path, text):
+    with open(path, "w") as f:
+        f.write(text)
+
+async def tail_file(path):
+    """Yield lines appended to path from now on"""
+    try:
+        f = await asyncio.to_thread(open, path, errors="replace")
+    except OSError as e:
+        logger.debug(f"Cannot follow {path}: {e}")
+        return
+    try:
+        f.seek(0, os.SEEK_END)
+        while True:
+            line = f.readline()
+            if line:
+                yield line
             else:
-                r = await c.post(f"http://localhost:{port}/v1/chat/completions", 
-                    json={"model": "test", "messages": [{"role": "user", "content": "hi"}], "max_tokens": 1, "stream": False},
-                    headers=headers)
-            return r.status_code in [200, 404]  # 404 means server up, just wrong model name
-    except: return False
+                await asyncio.sleep(0.25)
+    finally:
+        f.close()
 
+class SystemdManager:
+    """Controls backend services through systemctl using asyncio subprocesses, so the event loop
+    keeps serving /health, /v1/models and active streams while systemd works"""
+    async def run(self, *cmd):
+        try:
+            proc = await asyncio.create_subprocess_exec(*cmd, stdout=asyncio.subprocess.DEVNULL, stderr=asyncio.subprocess.PIPE)
+            _, err = await proc.communicate()
+        except OSError as e:
+            logger.error(f"{' '.join(cmd)} failed: {e}")
+            return False
+        if proc.returncode != 0 and cmd[0] == "systemctl":
+            logger.warning(f"{' '.join(cmd)} exited {proc.returncode}: {err.decode(errors='replace').strip()}")
+        return proc.returncode == 0
 
-async def wait_ready(backend):
-    start = time.time()
-    while (time.time() - start) < MODEL_LOAD_TIMEOUT:
-        if await check_health(backend):
-            yield {"status": "ready", "elapsed": int(time.time() - start)}
+    async def start(self, service):
+        return await self.run("systemctl", "start", service)
+
+    async def stop(self, service):
+        return await self.run("systemctl", "stop", service)
+
+    async def kill(self, process):
+        return await self.run("pkill", "-9", process)
+
+    def follow(self, service, since, log_file=None):
+        """Async iterator over new lines from the service's journal (or its log_file)"""
+        if log_file:
+            return tail_file(log_file)
+        return self._journal(service, since)
+
+    async def _journal(self, service, since):
+        try:
+            proc = await asyncio.create_subprocess_exec("journalctl", "-u", service, "-f", "-o", "cat", f"--since=@{int(since)}",
+                                                        stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.DEVNULL)
+        except OSError as e:
+            logger.debug(f"Cannot follow journal for {service}: {e}")
             return
-        if int(time.time() - start) % 10 == 0:
-            yield {"status": "loading", "elapsed": int(time.time() - start)}
-        await asyncio.sleep(2)
-    yield {"status": "timeout"}
+        try:
+            async for line in proc.stdout:
+                yield line.decode(errors="replace")
+        finally:
+            if proc.returncode is None:
+                proc.kill()
+
+class ExternalManager:
+    """Service manager for backends that are run outside the router (mock backends, tests, containers):
+    start/stop are no-ops, or run `service_commands.start`/`.stop` (with {service}, {backend} and
+    {port} filled in) when configured; readiness is still detected through the health checks"""
+    async def command(self, action, service):
+        template = SERVICE_COMMANDS.get(action)
+        if not template:
+            return True
+        backend = next((b for b, svc in SERVICE_MAP.items() if svc == service), service)
+        port = {"sglang": SGLANG_PORT, "tabbyapi": TABBY_PORT, "llamacpp": LLAMACPP_PORT}.get(backend, "")
+        return await SystemdManager().run(*shlex.split(template.format(service=service, backend=backend, port=port)))
 
-async def start_backend(model_info):
+    async def start(self, service): return await self.command("start", service)
+    async def stop(self, service): return await self.command("stop", service)
+    async def kill(self, process): return True
+
+    def follow(self, service, since, log_file=None):
+        return tail_file(log_file) if log_file else None
+
+SERVICE_MANAGERS = {"systemd": SystemdManager, "external": ExternalManager}
+if SERVICE_MANAGER not in SERVICE_MANAGERS:
+    logger.warning(f"Unknown service_manager {SERVICE_MANAGER!r}, using systemd")
+services = SERVICE_MANAGERS.get(SERVICE_MANAGER, SystemdManager)()
+
+SERVICE_MAP = {"sglang": "sglang.service", "tabbyapi": "tabbyapi.service", "llamacpp": "llamacpp.service"}
+
+async def start_backend(model, evicted):
+    """Load model, stopping its backend and the backends in evicted (those of the models the placement evicted)"""
+    model_info = MODELS[model]
     backend = model_info["backend"]
+    phase_start = time.monotonic()
     
-    # Stop all backends
-    subprocess.run(["systemctl", "stop", "sglang.service"], capture_output=True)
-    subprocess.run(["systemctl", "stop", "tabbyapi.service"], capture_output=True)
-    subprocess.run(["systemctl", "stop", "llamacpp.service"], capture_output=True)
-    subprocess.run(["pkill", "-9", "llama-server"], capture_output=True)
-    await asyncio.sleep(2)
+    # Stop the target backend and whatever the placement evicted (everything while the
+    # running set is still unknown after a router restart), independently so in parallel
+    if state["loaded"] is None:
+        stop = set(SERVICE_MAP)
+    else:
+        stop = {backend} | evicted
+    # A running TabbyAPI can swap models over its API without a process restart
+    in_place = backend == "tabbyapi" and BACKENDS.get("tabbyapi", {}).get("in_place_switch", True) and await tabby.alive()
+    if in_place:
+        stop.discard("tabbyapi")
+    if stop:
+        logger.info(f"Stopping {sorted(stop)} to load {backend} model {model_info.get('model_path')}")
+        for b in stop:
+            health_cache.invalidate(b)
+            liveness.invalidate(b)
+        tasks = [services.stop(SERVICE_MAP[b]) for b in stop if b in SERVICE_MAP]
+        if "llamacpp" in stop:
+            tasks.append(services.kill("llama-server"))
+        await asyncio.gather(*tasks)
+        await asyncio.sleep(2)
+    SWITCHES.observe(time.monotonic() - phase_start, model, "stop")
+    phase_start = time.monotonic()
     
-    # Update TabbyAPI config if needed
+    # Update TabbyAPI config if needed (also keeps a later service restart on the same model)
     if backend == "tabbyapi":
-        # Extract model name from path (e.g., "exl2/Model-Name")
-        model_name = model_info["model_path"]
-        config_yml = f"""developer:
+        await asyncio.to_thread(write_file, TABBY_CONFIG_PATH, tabby_config_yml(model_info))
+    
+    if in_place:
+        logger.info(f"Loading {model_info['model_path']} into running TabbyAPI")
+        async for s in tabby.switch(model_info):
+            if s["status"] == "loaded":
+                SWITCHES.observe(time.monotonic() - phase_start, model, "start")
+                phase_start = time.monotonic()
+                continue
+            if s["status"] == "ready":
+                SWITCHES.observe(time.monotonic() - phase_start, model, "ready")
+            if s["status"] != "fallback":
+                yield s
+                continue
+            logger.warning("Falling back to restarting tabbyapi.service")
+            await services.stop(SERVICE_MAP["tabbyapi"])
+            await asyncio.sleep(2)
+            break
+        else:
+            return
+    
+    # Start the appropriate service
+    service = SERVICE_MAP.get(backend)
+    
+    if service:
+        since = time.time()
+        await services.start(service)
+        SWITCHES.observe(time.monotonic() - phase_start, model, "start")
+        phase_start = time.monotonic()
+        async for s in wait_ready(backend, since):
+            if s["status"] == "ready":
+                SWITCHES.observe(time.monotonic() - phase_start, model, "ready")
+            yield s
+    else:
+        yield {"status": "error", "message": f"Unknown backend: {backend}"}
+
+def tabby_settings(model_info):
+    """Per-model TabbyAPI load settings, overridable in the model's config entry"""
+    max_seq_len = model_info.get("max_seq_len", 32768)
+    return {"cache_mode": model_info.get("cache_mode", "FP16"), "max_seq_len": max_seq_len,
+            "cache_size": model_info.get("cache_size", max_seq_len), "max_batch_size": model_info.get("max_batch_size", 1)}
+
+def tabby_config_yml(model_info):
+    # Extract model name from path (e.g., "exl2/Model-Name")
+    model_name = model_info["model_path"]
+    t = tabby_settings(model_info)
+    return f"""developer:
   backend: exllamav2
   unsafe_launch: false
 logging:
@@ -106,12 +1785,12 @@ logging:
   log_prompt: false
   log_requests: false
 model:
-  cache_mode: FP16
-  cache_size: 32768
+  cache_mode: {t['cache_mode']}
+  cache_size: {t['cache_size']}
   chunk_size: 4096
   gpu_split_auto: true
-  max_batch_size: 1
-  max_seq_len: 32768
+  max_batch_size: {t['max_batch_size']}
+  max_seq_len: {t['max_seq_len']}
   model_dir: {TABBY_MODEL_DIR}
   model_name: {model_name}
   tensor_parallel: false
@@ -122,91 +1801,1185 @@ network:
   host: 0.0.0.0
   port: {TABBY_PORT}
 """
-        with open(TABBY_CONFIG_PATH, "w") as f:
-            f.write(config_yml)
-    
-    # Start the appropriate service
-    service_map = {"sglang": "sglang.service", "tabbyapi": "tabbyapi.service", "llamacpp": "llamacpp.service"}
-    service = service_map.get(backend)
-    
-    if service:
-        subprocess.run(["systemctl", "start", service], capture_output=True)
-        async for s in wait_ready(backend): yield s
-    else:
-        yield {"status": "error", "message": f"Unknown backend: {backend}"}
+
+class TabbyDriver:
+    """Swaps TabbyAPI models in place through its admin API (/v1/model/unload, /v1/model/load),
+    keeping the Python/CUDA process alive instead of restarting the service"""
+    async def alive(self):
+        try:
+            r = await clients["tabbyapi"].get("/v1/model", headers=tabby_headers(), timeout=2.0)
+            return r.status_code in (200, 400, 404)  # 400/404 also mean up, just no model loaded
+        except httpx.HTTPError:
+            return False
+
+    async def switch(self, model_info):
+        """Unload the current model and load model_info's, yielding wait_ready-style statuses plus
+        {"status": "loaded"} once the load call completes. Yields {"status": "fallback"} (before any
+        model is loaded) if the API can't do the swap."""
+        c = clients["tabbyapi"]
+        headers = tabby_headers()
+        start = time.time()
+        try:
+            r = await c.post("/v1/model/unload", headers=headers, timeout=30.0)
+            if r.status_code not in (200, 400, 404):  # 400/404: nothing was loaded
+                logger.warning(f"TabbyAPI unload failed ({r.status_code}): {r.text[:200]}")
+                yield {"status": "fallback"}
+                return
+            body = {"model_name": model_info["model_path"], **tabby_settings(model_info)}
+            parser = SSEParser()
+            last_report = 0.0
+            async with c.stream("POST", "/v1/model/load", json=body, headers=headers,
+                                timeout=httpx.Timeout(10.0, read=MODEL_LOAD_TIMEOUT)) as r:
+                if r.status_code != 200:
+                    logger.warning(f"TabbyAPI load failed ({r.status_code}): {(await r.aread())[:200]!r}")
+                    yield {"status": "fallback"}
+                    return
+                # Progress events look like {"model_type": "model", "module": 12, "modules": 81, "status": "processing"}
+                async for chunk in r.aiter_bytes():
+                    for data in parser.feed(chunk):
+                        try:
+                            event = json.loads(data)
+                        except ValueError:
+                            continue
+                        if "error" in event:
+                            yield {"status": "error", "message": f"TabbyAPI load failed: {event['error']}"}
+                            return
+                        if time.time() - last_report >= 2 and event.get("modules"):
+                            last_report = time.time()
+                            yield {"status": "loading", "elapsed": int(time.time() - start),
+                                   "detail": f"{event.get('model_type', 'model')} {event.get('module')}/{event['modules']}"}
+        except httpx.HTTPError as e:
+            logger.warning(f"TabbyAPI in-place switch failed: {e}")
+            yield {"status": "fallback"}
+            return
+        yield {"status": "loaded"}
+        async for s in wait_ready("tabbyapi"):
+            yield {**s, "elapsed": int(time.time() - start)}
+
+tabby = TabbyDriver()
 
 @app.get("/v1/models")
 async def list_models():
     return {"object": "list", "data": [{"id": k, "object": "model", "created": 1234567890, "owned_by": "local"} for k in MODELS.keys()]}
 
-@app.post("/v1/chat/completions")
-async def chat(request: Request):
-    body = await request.json()
-    model = body.get("model")
+def abort_generation(client, route, rid):
+    """Ask the backend to stop generating rid through its abort API (SGLang's /abort_request by
+    default); fire-and-forget, safe to call while a generator is closing"""
+    async def abort():
+        try:
+            r = await client.post(route.abort_endpoint, json={"rid": rid}, timeout=2.0)
+            BACKEND_ABORTS.inc(route.backend, "ok" if r.status_code < 400 else "error")
+        except httpx.HTTPError as e:
+            BACKEND_ABORTS.inc(route.backend, "error")
+            logger.warning(f"Could not abort {rid} on {route.backend}: {e!r}")
+    spawn(abort())
+
+class BackendStatusError(Exception):
+    """The backend answered a streaming request with an HTTP error status, before any event"""
+    def __init__(self, status_code, detail):
+        super().__init__(detail)
+        self.status_code = status_code
+
+async def proxy_stream(model, body, path="/v1/chat/completions", record=None, capture=None, routes=None, report_model=False):
+    """Proxy a streaming completion from the model's backend, re-framed and measured. With report_model
+    the chunks' `model` is set to model (the router's name) instead of what the backend calls it.
+    Raises BackendStatusError, before yielding anything, when the backend answers with an error status."""
+    routes = routes or routing
+    route = routes.routes[model]
+    # Chat streams when "stream" is omitted (see streams()); OpenAI-compatible backends default to false
+    body["stream"] = True
+    # Ask for a final usage chunk so token counts come from the backend, not a guess
+    wants_usage = (body.get("stream_options") or {}).get("include_usage")
+    if not wants_usage and route.stream_usage:
+        body["stream_options"] = {**(body.get("stream_options") or {}), "include_usage": True}
     
-    if model not in MODELS:
-        return {"error": f"Model {model} not found"}
+    # SGLang's native /generate skips the OpenAI adapter layer for plain completions
+    native, upstream_path, upstream_body = None, path, body
+    if GenerateStream.eligible(model, route, body, path):
+        native = GenerateStream(model, body, chat=path == "/v1/chat/completions")
+        try:
+            upstream_path, upstream_body = "/generate", native.request()
+        except ChatTemplateError as e:
+            logger.warning(f"Chat template for {model} rejected the conversation ({e}); using the OpenAI endpoint")
+            native = None
+    
+    # Tag the request so the backend's abort API can cancel it if the client goes away
+    rid = None
+    if route.abort_endpoint:
+        rid = upstream_body["rid"] = f"router-{os.urandom(8).hex()}"
     
-    async def generate():
-        async with switching_lock:
-            if state["current_model"] != model:
-                yield create_sse({"choices": [{"delta": {"content": f"🔄 Switching to {model}...\n"}}]})
-                async for s in start_backend(MODELS[model]):
-                    if s["status"] == "loading":
-                        yield create_sse({"choices": [{"delta": {"content": f"⏳ {s['elapsed']}s\n"}}]})
+    # Track performance metrics
+    stats = StreamStats(model)
+    
+    # Events are only decoded when something needs their contents: the cache, a model rename, text
+    # counting when no usage will arrive, or the usage/timings chunks themselves. The rest are
+    # forwarded as they came, measured by a byte scan for generated text.
+    parse_all = capture is not None or report_model or not (wants_usage or route.stream_usage)
+    
+    parser = SSEParser()
+    queue = asyncio.Queue(maxsize=STREAM_QUEUE_SIZE)
+    async with AsyncExitStack() as stack:
+        c, r = await routes.replicas.stream(stack, model, body, 'POST', upstream_path, content=dumps(upstream_body), headers=JSON_HEADERS)
+        if r.status_code >= 400:
+            BACKEND_ERRORS.inc(route.backend)
+            detail = (await r.aread()).decode(errors="replace")[:500]
+            logger.error(f"{route.backend} returned {r.status_code} for {model}: {detail}")
+            raise BackendStatusError(r.status_code, detail)
+        pump = asyncio.create_task(pump_stream(r, queue))
+        try:
+            done = False
+            while not done:
+                # Drain everything already buffered so a slow client gets one write instead of many
+                chunks = [await queue.get()]
+                while not queue.empty():
+                    chunks.append(queue.get_nowait())
+                if chunks[-1] is None:
+                    done = True
+                    chunks.pop()
+                frames = []
+                for arrived, chunk in chunks:
+                    for data in parser.feed(chunk):
+                        if data == b"[DONE]":
+                            continue
+                        if native:
+                            try:
+                                translated = native.translate(native.parse(data))
+                            except (ValueError, AttributeError):
+                                continue
+                            for chunk_data in translated:
+                                stats.observe(chunk_data, arrived)
+                                if capture is not None:
+                                    capture.observe(chunk_data)
+                                if wants_usage or chunk_data["choices"]:
+                                    frames.append(create_sse(chunk_data))
+                            continue
+                        if not parse_all and not METRICS_EVENT.search(data):
+                            if GENERATED_TEXT.search(data):
+                                stats.tick(arrived)
+                            frames.append(b"data: " + data + b"\n\n")
+                            continue
+                        try:
+                            chunk_data = loads(data)
+                            stats.observe(chunk_data, arrived)
+                            if capture is not None:
+                                capture.observe(chunk_data)
+                            # Don't hand a usage-only chunk to a client that never asked for one
+                            if not wants_usage and not chunk_data.get("choices") and "usage" in chunk_data:
+                                continue
+                            if report_model and chunk_data.get("model", model) != model:
+                                frames.append(create_sse({**chunk_data, "model": model}))
+                                continue
+                        except (ValueError, AttributeError):
+                            pass
+                        frames.append(b"data: " + data + b"\n\n")
+                if frames:
+                    yield b"".join(frames)
+            await pump  # surface upstream read errors
+        except (asyncio.CancelledError, GeneratorExit):
+            if rid:
+                abort_generation(c, route, rid)
+            raise
+        finally:
+            pump.cancel()
+    
+    # Append performance metrics after completion
+    perf = await stats.finish()
+    if perf and record is not None:
+        record.update(tokens=perf["tokens"], prompt_tokens=perf["prompt_tokens"], ttft=round(perf["ttft"], 3))
+    if perf:
+        perf_message = (f"\n\n[Performance: {perf['decode_tps']:.1f} tok/s | {perf['tokens']} tokens in {perf['elapsed']:.2f}s"
+                        f" | TTFT {perf['ttft']:.2f}s]")
+        yield content_sse(perf_message, path)
+        prefill = f", prefill {perf['prefill_tps']:.1f} tok/s" if perf["prefill_tps"] else ""
+        logger.info(f"Performance: {perf['decode_tps']:.1f} tok/s decode ({perf['tokens']} tokens [{perf['source']}] in {perf['elapsed']:.2f}s, "
+                    f"TTFT {perf['ttft']:.2f}s{prefill})")
+    
+    yield SSE_DONE
+
+async def switch_model(model):
+    """Carry out a switch granted by lease.acquire(): drain the evicted models, load model and take a
+    shared lease on it. Yields draining/loading statuses and ends with "ready" (the caller now holds a
+    lease) or an error status; consume it under aclosing() so an abandoned switch is released promptly."""
+    done = False
+    try:
+        if coordinator.path:
+            async for s in coordinator.begin(model):
+                yield s
+            # Another worker may have loaded model, or something else, in the meantime
+            if model in resident_models():
+                lease.switched(model)
+                done = True
+                yield {"status": "ready"}
+                return
+            lease.evicting = lease.placement.plan(model)
+        # Which backends run the evicted models, taken before drain() drops them from state["loaded"]
+        evicted = {b for b, m in (state["loaded"] or {}).items() if m in lease.evicting}
+        async for n in lease.drain():
+            yield {"status": "draining", "active": n}
+        await coordinator.announce(lease.evicting)
+        switch_start = time.monotonic()
+        async for s in start_backend(model, evicted):
+            if s["status"] == "ready":
+                lease.placement.loaded(model, time.monotonic() - switch_start)
+                lease.switched(model)
+                done = True
+            elif s["status"] != "loading":
+                lease.failed()
+                done = True
+            yield s
+            if done:
+                return
+    finally:
+        if not done:
+            lease.failed()
+
+# Background switches started for rejected non-streaming requests, one per model
+background_switches = {}
+
+async def background_switch(model):
+    """Queue and load model with no client attached; returns True once it is loaded"""
+    if not await lease.acquire(model):
+        lease.release(model)
+        return True
+    async with aclosing(switch_model(model)) as statuses:
+        async for s in statuses:
+            if s["status"] == "ready":
+                lease.release(model)
+                return True
+            if s["status"] not in ("draining", "loading"):
+                logger.error(f"Background switch to {model} failed: {s.get('message', s['status'])}")
+    return False
+
+def start_background_switch(model):
+    """Start loading model with no client attached; a switch already running for it is reused"""
+    task = background_switches.get(model)
+    if task is None:
+        task = background_switches[model] = asyncio.create_task(background_switch(model))
+        task.add_done_callback(lambda t: background_switches.pop(model, None))
+    return task
+
+class RequestLog:
+    """Append-only JSON-lines log of finished requests (`request_log.path`), one compact object per
+    request: start time, model, endpoint, prompt size, max_tokens, TTFT, tokens, time spent switching,
+    latency and outcome (plus the backend's HTTP status when it refused a stream). Lines are buffered and flushed every `request_log.flush_interval` seconds.
+    scripts/replay.py replays it against a router; the pre-warmer learns from it on first start."""
+    def __init__(self, cfg):
+        self.path = cfg.get("path")
+        self.flush_interval = cfg.get("flush_interval", 1.0)
+        self.file = None
+        self.flush_pending = False
+
+    def open(self):
+        if self.path:
+            try:
+                self.file = open(self.path, "a", buffering=1 << 16)
+            except OSError as e:
+                logger.error(f"Request log disabled, cannot open {self.path}: {e}")
+
+    def close(self):
+        if self.file:
+            self.file.close()
+            self.file = None
+
+    def begin(self, model, body, path):
+        """A record to fill in while the request runs (None when logging is off)"""
+        if not self.file:
+            return None
+        if body.get("messages"):
+            prompt_chars = sum(len(m["content"]) for m in body["messages"] if isinstance(m.get("content"), str))
+        else:
+            prompt_chars = len(body.get("prompt") or body.get("input") or "")
+        return {"ts": round(time.time(), 3), "model": model, "endpoint": path, "stream": streams(body, path),
+                "prompt_chars": prompt_chars, "max_tokens": body.get("max_tokens") or body.get("max_completion_tokens"),
+                "switch": 0.0}
+
+    def end(self, record, status):
+        if record is None or not self.file:
+            return
+        record["status"] = status
+        record["latency"] = round(time.time() - record["ts"], 3)
+        self.file.write(json.dumps(record, separators=(",", ":")) + "\n")
+        if not self.flush_pending:
+            self.flush_pending = True
+            asyncio.get_running_loop().call_later(self.flush_interval, self.flush)
+
+    def flush(self):
+        self.flush_pending = False
+        if self.file:
+            self.file.flush()
+
+request_log = RequestLog(REQUEST_LOG)
+
+class Capture:
+    """Collects a streamed response for the response cache: content pieces in their original chunking,
+    finish reason and usage. Responses with tool calls or errors are not cacheable."""
+    KINDS = (("content", "c"), ("reasoning_content", "r"))
+
+    def __init__(self):
+        self.pieces = []  # [kind, text]: c(ontent), r(easoning), t(ext completion)
+        self.finish_reason = None
+        self.usage = None
+        self.cacheable = True
+
+    def observe(self, chunk_data):
+        if "error" in chunk_data:
+            self.cacheable = False
+        if chunk_data.get("usage"):
+            self.usage = chunk_data["usage"]
+        for choice in chunk_data.get("choices") or ():
+            delta = choice.get("delta") or {}
+            if delta.get("tool_calls") or choice.get("index", 0) != 0:
+                self.cacheable = False
+            for key, kind in self.KINDS:
+                if delta.get(key):
+                    self.pieces.append([kind, delta[key]])
+            if choice.get("text"):
+                self.pieces.append(["t", choice["text"]])
+            self.finish_reason = choice.get("finish_reason") or self.finish_reason
+
+    def entry(self):
+        if self.cacheable and self.pieces and self.finish_reason in ("stop", "length"):
+            return {"pieces": self.pieces, "finish_reason": self.finish_reason, "usage": self.usage}
+        return None
+
+class ResponseCache:
+    """Opt-in cache of deterministic responses (`cache: true` on a model, temperature 0, one choice).
+    Requests for logprobs or an echoed prompt bypass it, since entries keep only the generated text.
+
+    Keyed on a SHA-256 of the canonical request (model, endpoint and every body field except the
+    streaming options). Entries hold the response's content pieces, so a streamed and a JSON request
+    fill and hit the same entry: streams are replayed as SSE in the original chunking, JSON requests
+    get the joined message. An in-memory LRU (`response_cache.max_entries`, `.max_bytes`) sits in
+    front of an optional disk tier (`.disk_path`, capped at `.disk_max_bytes`, oldest files dropped
+    first); entries expire after `.ttl` seconds in both.
+    """
+    IGNORED = ("stream", "stream_options", "user")
+    UNCACHED = ("logprobs", "top_logprobs", "echo")  # response parts an entry does not keep
+    WORDS = re.compile(r"\S+\s*|\s+")
+
+    def __init__(self, cfg):
+        self.max_entries = cfg.get("max_entries", 1024)
+        self.max_bytes = cfg.get("max_bytes", 64 << 20)
+        self.ttl = cfg.get("ttl", 86400)
+        self.disk_path = cfg.get("disk_path")
+        self.disk_max_bytes = cfg.get("disk_max_bytes", 1 << 30)
+        self.memory = collections.OrderedDict()  # key -> (expires, size, entry)
+        self.bytes = 0
+        self.disk_bytes = None  # scanned on first store
+
+    def key(self, body, path):
+        """Cache key for a cacheable request to a model with `cache` set, else None"""
+        if path not in ("/v1/chat/completions", "/v1/completions"):
+            return None
+        if body.get("temperature", 1) != 0 or body.get("n", 1) != 1:
+            return None
+        if any(body.get(k) is not None and body.get(k) is not False for k in self.UNCACHED):
+            return None
+        canonical = {k: v for k, v in body.items() if k not in self.IGNORED}
+        text = json.dumps([path, canonical], sort_keys=True, separators=(",", ":"), ensure_ascii=False)
+        return hashlib.sha256(text.encode()).hexdigest()
+
+    def file(self, key):
+        return os.path.join(self.disk_path, key[:2], key)
+
+    async def get(self, model, key):
+        hit = self.memory.get(key)
+        if hit and hit[0] > time.time():
+            self.memory.move_to_end(key)
+            CACHE_LOOKUPS.inc(model, "hit_memory")
+            return hit[2]
+        if hit:
+            self.drop(key)
+        if self.disk_path:
+            entry = await asyncio.to_thread(self.read, key)
+            if entry:
+                self.remember(key, entry, entry.pop("expires"))
+                CACHE_LOOKUPS.inc(model, "hit_disk")
+                return entry
+        CACHE_LOOKUPS.inc(model, "miss")
+        return None
+
+    def read(self, key):
+        try:
+            with open(self.file(key)) as f:
+                entry = json.load(f)
+        except (OSError, ValueError):
+            return None
+        if entry.get("expires", 0) <= time.time():
+            try:
+                os.remove(self.file(key))
+            except OSError:
+                pass
+            return None
+        return entry
+
+    def drop(self, key):
+        _, size, _ = self.memory.pop(key)
+        self.bytes -= size
+
+    def remember(self, key, entry, expires):
+        size = sum(len(text) for _, text in entry["pieces"])
+        if key in self.memory:
+            self.drop(key)
+        self.memory[key] = (expires, size, entry)
+        self.bytes += size
+        while self.memory and (len(self.memory) > self.max_entries or self.bytes > self.max_bytes):
+            self.drop(next(iter(self.memory)))
+
+    async def put(self, model, key, entry):
+        if entry is None:
+            return
+        expires = time.time() + self.ttl
+        self.remember(key, entry, expires)
+        CACHE_LOOKUPS.inc(model, "store")
+        if self.disk_path:
+            await asyncio.to_thread(self.write, key, {**entry, "expires": expires})
+
+    def write(self, key, entry):
+        try:
+            path = self.file(key)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            if self.disk_bytes is None:
+                self.disk_bytes = sum(e.stat().st_size for e in self.files())
+            write_file(f"{path}.tmp", json.dumps(entry))
+            os.replace(f"{path}.tmp", path)
+            self.disk_bytes += os.path.getsize(path)
+            if self.disk_bytes > self.disk_max_bytes:
+                self.trim()
+        except OSError as e:
+            logger.warning(f"Response cache write failed: {e}")
+
+    def files(self):
+        for d in os.scandir(self.disk_path):
+            if d.is_dir():
+                yield from (e for e in os.scandir(d.path) if e.is_file() and not e.name.endswith(".tmp"))
+
+    def trim(self):
+        """Drop the oldest files until the disk tier is 10% under its cap"""
+        entries = sorted(self.files(), key=lambda e: e.stat().st_mtime)
+        for e in entries:
+            if self.disk_bytes <= self.disk_max_bytes * 0.9:
+                break
+            size = e.stat().st_size
+            os.remove(e.path)
+            self.disk_bytes -= size
+
+    def pieces(self, entry):
+        """Pieces to stream: the original chunks, or word-sized ones for entries filled from JSON"""
+        if len(entry["pieces"]) == 1:
+            kind, text = entry["pieces"][0]
+            return [[kind, word] for word in self.WORDS.findall(text)]
+        return entry["pieces"]
+
+    @staticmethod
+    def response_id(path):
+        """A fresh id per hit, so clients that track responses by id never see a repeat"""
+        return f"{'chatcmpl' if path == '/v1/chat/completions' else 'cmpl'}-{os.urandom(12).hex()}"
+
+    def stream(self, model, body, path, entry):
+        """The cached response as one SSE write, in the chunking the backend originally used"""
+        chat = path == "/v1/chat/completions"
+        base = {"id": self.response_id(path), "object": "chat.completion.chunk" if chat else "text_completion",
+                "created": int(time.time()), "model": model}
+        frames = []
+        for kind, text in self.pieces(entry):
+            if chat:
+                choice = {"index": 0, "delta": {"reasoning_content" if kind == "r" else "content": text}, "finish_reason": None}
+            else:
+                choice = {"index": 0, "text": text, "finish_reason": None}
+            frames.append(create_sse({**base, "choices": [choice]}))
+        last = {"index": 0, "delta": {}} if chat else {"index": 0, "text": ""}
+        frames.append(create_sse({**base, "choices": [{**last, "finish_reason": entry["finish_reason"]}]}))
+        if (body.get("stream_options") or {}).get("include_usage") and entry.get("usage"):
+            frames.append(create_sse({**base, "choices": [], "usage": entry["usage"]}))
+        tokens = (entry.get("usage") or {}).get("completion_tokens")
+        frames.append(content_sse(f"\n\n[Cached response{f' | {tokens} tokens' if tokens else ''}]", path))
+        frames.append(SSE_DONE)
+        return b"".join(frames)
+
+    def json(self, model, path, entry):
+        content = "".join(text for kind, text in entry["pieces"] if kind != "r")
+        reasoning = "".join(text for kind, text in entry["pieces"] if kind == "r")
+        if path == "/v1/chat/completions":
+            message = {"role": "assistant", "content": content}
+            if reasoning:
+                message["reasoning_content"] = reasoning
+            choice = {"index": 0, "message": message, "finish_reason": entry["finish_reason"]}
+            kind = "chat.completion"
+        else:
+            choice = {"index": 0, "text": content, "finish_reason": entry["finish_reason"]}
+            kind = "text_completion"
+        response = {"id": self.response_id(path), "object": kind, "created": int(time.time()), "model": model, "choices": [choice]}
+        if entry.get("usage"):
+            response["usage"] = entry["usage"]
+        return response
+
+    @staticmethod
+    def from_json(data):
+        """Cache entry from a non-streaming backend response body"""
+        try:
+            payload = loads(data)
+            choice = payload["choices"][0]
+        except (ValueError, KeyError, IndexError, TypeError):
+            return None
+        if len(payload["choices"]) != 1 or choice.get("finish_reason") not in ("stop", "length"):
+            return None
+        message = choice.get("message")
+        if message is not None:
+            if message.get("tool_calls"):
+                return None
+            pieces = [["c", message.get("content") or ""]]
+            if message.get("reasoning_content"):
+                pieces.insert(0, ["r", message["reasoning_content"]])
+        else:
+            pieces = [["t", choice.get("text") or ""]]
+        return {"pieces": pieces, "finish_reason": choice["finish_reason"], "usage": payload.get("usage")}
+
+response_cache = ResponseCache(RESPONSE_CACHE)
+
+class Prewarmer:
+    """Loads the most likely next model while the router is idle (`prewarm.enabled`).
+
+    Every accepted request updates two tables: how often each model followed the previous
+    request's model, and how often each model was requested in each hour of the day. Once no
+    request has arrived for `prewarm.idle_seconds`, the candidates are scored as a blend of the
+    two (`prewarm.hour_weight`) and the best one scoring at least `prewarm.min_probability` is
+    loaded in the background, at most once per idle period. Models that would evict a resident
+    are skipped unless `prewarm.allow_eviction` is set. The tables are kept in
+    `prewarm.state_file`, if given, so they survive restarts.
+    """
+    def __init__(self, cfg):
+        self.enabled = cfg.get("enabled", False)
+        self.idle = cfg.get("idle_seconds", 300)
+        self.interval = cfg.get("check_interval", 30)
+        self.min_probability = cfg.get("min_probability", 0.3)
+        self.hour_weight = cfg.get("hour_weight", 0.3)
+        self.allow_eviction = cfg.get("allow_eviction", False)
+        self.state_file = cfg.get("state_file")
+        self.transitions = collections.defaultdict(collections.Counter)  # previous model -> next model counts
+        self.hours = collections.defaultdict(collections.Counter)        # hour of day -> model counts
+        self.last_model = None
+        self.last_request = time.time()
+        self.warmed_for = None  # last_request of the idle period already pre-warmed
+        self.predicted = None   # model pre-warmed on a prediction, until the next request
+        self.dirty = False
+        self.task = None
+        self.load()
+
+    def load(self):
+        if not self.state_file or not os.path.isfile(self.state_file):
+            self.learn(request_log.path)
+            return
+        try:
+            saved = json.load(open(self.state_file))
+            for prev, counts in saved.get("transitions", {}).items():
+                self.transitions[prev].update(counts)
+            for hour, counts in saved.get("hours", {}).items():
+                self.hours[int(hour)].update(counts)
+        except (OSError, ValueError) as e:
+            logger.warning(f"Could not read pre-warm state {self.state_file}: {e}")
+
+    def learn(self, path):
+        """Seed the tables from a request log"""
+        if not self.enabled or not path or not os.path.isfile(path):
+            return
+        try:
+            with open(path) as f:
+                for line in f:
+                    entry = json.loads(line)
+                    if entry.get("model") in MODELS:
+                        self.observe(entry["model"], entry["ts"])
+            logger.info(f"Pre-warmer learned from {path}")
+        except (OSError, ValueError, KeyError) as e:
+            logger.warning(f"Could not learn from request log {path}: {e}")
+        self.predicted = None
+
+    def save(self):
+        if not self.state_file or not self.dirty:
+            return
+        tmp = f"{self.state_file}.tmp"
+        try:
+            write_file(tmp, json.dumps({"transitions": self.transitions, "hours": self.hours}))
+            os.replace(tmp, self.state_file)
+            self.dirty = False
+        except OSError as e:
+            logger.warning(f"Could not write pre-warm state {self.state_file}: {e}")
+
+    def observe(self, model, when=None):
+        """Record an accepted request for model"""
+        if self.predicted:
+            PREDICTIONS.inc("hit" if model == self.predicted else "miss")
+            self.predicted = None
+        if self.last_model:
+            self.transitions[self.last_model][model] += 1
+        self.hours[time.localtime(when).tm_hour][model] += 1
+        self.last_model, self.last_request = model, time.time()
+        self.dirty = True
+
+    def predict(self, current, hour):
+        """(model, probability) candidates for the next request, most likely first"""
+        after, at = self.transitions.get(current, {}), self.hours.get(hour, {})
+        n_after, n_at = sum(after.values()), sum(at.values())
+        if not n_after and not n_at:
+            return []
+        w = self.hour_weight if n_after and n_at else (1.0 if n_at else 0.0)
+        scores = {m: (1 - w) * (after.get(m, 0) / n_after if n_after else 0) + w * (at.get(m, 0) / n_at if n_at else 0)
+                  for m in MODELS}
+        return sorted(scores.items(), key=lambda kv: kv[1], reverse=True)
+
+    def pick(self):
+        """The model to pre-warm now, or None"""
+        for model, p in self.predict(self.last_model, time.localtime().tm_hour):
+            if p < self.min_probability:
+                return None
+            if model in resident_models():
+                return None  # the best bet is already loaded
+            if self.allow_eviction or not lease.placement.plan(model):
+                return model
+        return None
+
+    async def tick(self):
+        self.save()
+        if time.time() - self.last_request < self.idle or self.warmed_for == self.last_request:
+            return
+        if lease.phase is not None or lease.waiting or any(lease.active.values()):
+            return
+        self.warmed_for = self.last_request
+        model = self.pick()
+        if model:
+            logger.info(f"Pre-warming {model} after {time.time() - self.last_request:.0f}s idle")
+            self.predicted = model
+            PREWARMS.inc(model, "predicted")
+            start_background_switch(model)
+
+    async def run(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            try:
+                await self.tick()
+            except Exception as e:
+                logger.error(f"Pre-warm check failed: {e!r}")
+
+    def start(self):
+        if self.enabled:
+            self.task = asyncio.create_task(self.run())
+
+    async def stop(self):
+        if self.task:
+            self.task.cancel()
+            self.task = None
+        self.save()
+
+prewarmer = Prewarmer(PREWARM)
+
+def error_response(status_code, message, retry_after=None, **extra):
+    """OpenAI-style error body with a proper HTTP status"""
+    headers = {"Retry-After": str(int(retry_after))} if retry_after else None
+    return JSONResponse({"error": {"message": message, "code": status_code, **extra}}, status_code=status_code, headers=headers)
+
+USAGE_COUNT = re.compile(rb'"(completion_tokens|prompt_tokens)"\s*:\s*(\d+)')
+
+def response_usage(content):
+    """Token counts from a JSON response body's `usage` without decoding the whole body: OpenAI-style
+    servers put usage last, so only what follows the last "usage" key is scanned"""
+    start = content.rfind(b'"usage"')
+    if start < 0:
+        return {}
+    return {key.decode(): int(value) for key, value in USAGE_COUNT.findall(content, start)}
+
+async def proxy_json(model, body, path="/v1/chat/completions", record=None, routes=None):
+    """Proxy a non-streaming request: one POST on the pooled client, backend body returned as-is"""
+    routes = routes or routing
+    backend = routes.routes[model].backend
+    start = time.time()
+    try:
+        async with AsyncExitStack() as stack:
+            c, r = await routes.replicas.stream(stack, model, body, "POST", path, content=dumps(body), headers=JSON_HEADERS)
+            await r.aread()
+    except httpx.HTTPError as e:
+        BACKEND_ERRORS.inc(backend)
+        logger.error(f"Backend error for {model}: {e!r}")
+        return error_response(502, f"Backend error: {e!r}")
+    elapsed = time.time() - start
+    if r.status_code >= 400:
+        BACKEND_ERRORS.inc(backend)
+    else:
+        LATENCY.observe(elapsed, model)
+        usage = response_usage(r.content)
+        if record is not None:
+            record.update(tokens=usage.get("completion_tokens"), prompt_tokens=usage.get("prompt_tokens"))
+        if usage.get("completion_tokens"):
+            OUTPUT_TOKENS.inc(model, amount=usage["completion_tokens"])
+            logger.info(f"Performance: {usage['completion_tokens'] / elapsed:.1f} tok/s ({usage['completion_tokens']} tokens in {elapsed:.2f}s, non-streaming)")
+    return Response(content=r.content, status_code=r.status_code, media_type=r.headers.get("content-type", "application/json"))
+
+async def serve_json(model, call, priority=1, record=None):
+    """Run a non-streaming backend call under an admission slot and a lease on model: waits for a
+    switch silently (or rejects with 503 when non_streaming_switch is "reject") and returns call()'s response"""
+    if not lease.admissible(model) and NON_STREAMING_SWITCH == "reject":
+        start_background_switch(model)
+        REQUESTS.inc(model, "rejected")
+        request_log.end(record, "rejected")
+        eta = lease.placement.load_times.get(model, 30)
+        return error_response(503, f"Model {model} is loading, retry shortly", retry_after=max(1, eta))
+    leased = False
+    held = []
+    status = "error"
+    try:
+        held = await admission.acquire(model, priority)
+        switch_start = time.time()
+        queued = not lease.admissible(model)
+        leased = not await lease.acquire(model)
+        if leased and queued and record:
+            record["switch"] = round(time.time() - switch_start, 3)
+        if not leased:
+            async with aclosing(switch_model(model)) as statuses:
+                async for s in statuses:
+                    if s["status"] == "ready":
+                        leased = True
+                        if record:
+                            record["switch"] = round(time.time() - switch_start, 3)
+                    elif s["status"] not in ("draining", "loading"):
+                        status = "switch_failed"
+                        return error_response(503, f"Could not load {model}: {s.get('message', 'Timeout')}", retry_after=30)
+        held += await admission.acquire(model, priority, backend=True)
+        response = await call()
+        status = "ok" if response.status_code < 400 else "backend_error"
+        return response
+    except Rejected as e:
+        status = "rejected"
+        return error_response(429, str(e), retry_after=e.retry_after, type="rate_limit_error")
+    except asyncio.CancelledError:
+        status = "aborted"
+        ABORTED.inc(model)
+        raise
+    finally:
+        REQUESTS.inc(model, status)
+        request_log.end(record, status)
+        if leased:
+            lease.release(model)
+        admission.release(held)
+
+class EmbeddingBatcher:
+    """Coalesces concurrent /v1/embeddings requests for the same model and parameters into one
+    backend call: inputs are concatenated, flushed after window seconds or at max_inputs, and the
+    response is split back per caller with re-based indices and usage apportioned by input size
+    (which is also what each caller's request log record gets as its prompt_tokens)"""
+    def __init__(self, window, max_inputs):
+        self.window, self.max_inputs = window, max_inputs
+        self.pending = {}  # (model, params, routing table) -> [(inputs, future, record)]
+        self.tasks = set()
+
+    @staticmethod
+    def inputs(value):
+        """Normalise an embeddings `input` to a list of items (strings or token arrays)"""
+        if isinstance(value, str) or (isinstance(value, list) and value and isinstance(value[0], int)):
+            return [value]
+        return list(value)
+
+    async def embed(self, model, body, record=None, routes=None):
+        items = self.inputs(body.get("input", []))
+        if not items or len(items) >= self.max_inputs:
+            return await proxy_json(model, body, "/v1/embeddings", record, routes)
+        params = {k: v for k, v in body.items() if k != "input"}
+        key = (model, json.dumps(params, sort_keys=True), routes)
+        future = asyncio.get_running_loop().create_future()
+        batch = self.pending.get(key)
+        if batch is None:
+            batch = self.pending[key] = []
+            asyncio.get_running_loop().call_later(self.window, self._flush, key, batch)
+        batch.append((items, future, record))
+        if sum(len(i) for i, _, _ in batch) >= self.max_inputs:
+            self._flush(key, batch)
+        return await future
+
+    def _flush(self, key, batch):
+        if self.pending.get(key) is not batch:
+            return  # already flushed by size
+        del self.pending[key]
+        task = asyncio.create_task(self._send(key, batch))
+        self.tasks.add(task)
+        task.add_done_callback(self.tasks.discard)
+
+    async def _send(self, key, batch):
+        model, params, routes = key[0], json.loads(key[1]), key[2]
+        callers = [caller for caller in batch if not caller[1].done()]
+        if not callers:
+            return
+        try:
+            merged = [item for items, _, _ in callers for item in items]
+            # A lone caller's record is filled in by proxy_json; split() apportions a batch's usage
+            record = callers[0][2] if len(callers) == 1 else None
+            response = await proxy_json(model, {**params, "input": merged}, "/v1/embeddings", record, routes)
+            results = self.split(response, callers) if len(callers) > 1 else [response]
+        except Exception as e:
+            logger.error(f"Embedding batch for {model} failed: {e!r}")
+            results = [error_response(502, f"Embedding batch failed: {e!r}")] * len(callers)
+        for (_, future, _), result in zip(callers, results):
+            if not future.done():
+                future.set_result(result)
+
+    @staticmethod
+    def split(response, callers):
+        """Per-caller responses from one batched response (errors are fanned out unchanged)"""
+        if response.status_code >= 400:
+            return [response] * len(callers)
+        payload = loads(response.body)
+        data = sorted(payload.get("data", []), key=lambda d: d.get("index", 0))
+        usage = payload.get("usage") or {}
+        sizes = [sum(len(item) for item in items) or 1 for items, _, _ in callers]
+        results, offset = [], 0
+        for (items, _, record), size in zip(callers, sizes):
+            part = [{**d, "index": d.get("index", 0) - offset} for d in data[offset:offset + len(items)]]
+            offset += len(items)
+            share = {k: round(v * size / sum(sizes)) for k, v in usage.items() if isinstance(v, int)}
+            if record is not None:
+                record["prompt_tokens"] = share.get("prompt_tokens")
+            results.append(JSONResponse({**payload, "data": part, "usage": share}))
+        return results
+
+embedder = EmbeddingBatcher(EMBEDDING_BATCH.get("window_ms", 5) / 1000, EMBEDDING_BATCH.get("max_inputs", 256))
+
+async def generate(model, body, path, priority=1, record=None, cache_key=None, routes=None, fallback_for=None):
+    """Streaming response: status lines while the model is switched in, then the proxied stream.
+    Gives `routes` (checked out by the caller) back when it ends. When model answers for a cold
+    `fallback_for`, that one is loaded in the background once model's lease is held."""
+    leased = False
+    held = []
+    status = "error"
+    try:
+        held = await admission.acquire(model, priority)
+        switch_start = time.time()
+        waiter = lease.join(model)
+        queued = waiter is not None and not waiter.future.done()
+        if queued:
+            try:
+                yield content_sse(f"⏳ Waiting for model switch ({model} queued)...\n", path)
+            except BaseException:
+                lease.leave(model, waiter)
+                raise
+        leased = waiter is None or not await lease.wait(model, waiter)
+        if leased and queued:
+            # Another request carried out the switch this one was waiting for
+            if record:
+                record["switch"] = round(time.time() - switch_start, 3)
+            yield content_sse("✅ Ready!\n\n", path)
+        if not leased:
+            yield content_sse(f"🔄 Switching to {model}...\n", path)
+            async with aclosing(switch_model(model)) as statuses:
+                async for s in statuses:
+                    if s["status"] == "draining":
+                        yield content_sse(f"⏳ Waiting for {s['active']} active request(s) to finish...\n", path)
+                    elif s["status"] == "loading":
+                        detail = f" ({s['detail']})" if s.get("detail") else ""
+                        yield content_sse(f"⏳ {s['elapsed']}s{detail}\n", path)
                     elif s["status"] == "ready":
-                        state["current_model"] = model
-                        yield create_sse({"choices": [{"delta": {"content": "✅ Ready!\n\n"}}]})
-                        break
+                        leased = True
+                        if record:
+                            record["switch"] = round(time.time() - switch_start, 3)
+                        yield content_sse("✅ Ready!\n\n", path)
                     else:
-                        yield create_sse({"choices": [{"delta": {"content": f"❌ {s.get('message','Timeout')}\n"}, "finish_reason": "error"}]})
+                        status = "switch_failed"
+                        yield content_sse(f"❌ {s.get('message','Timeout')}\n", path, finish_reason="error")
                         return
+        held += await admission.acquire(model, priority, backend=True)
         
-        # Track performance metrics
-        start_time = time.time()
-        token_count = 0
-        
-        port = {"sglang": SGLANG_PORT, "tabbyapi": TABBY_PORT, "llamacpp": LLAMACPP_PORT}[MODELS[model]["backend"]]
-        async with httpx.AsyncClient(timeout=300.0) as c:
-            async with c.stream('POST', f"http://localhost:{port}/v1/chat/completions", json=body) as r:
-                async for chunk in r.aiter_bytes():
-                    chunk_str = chunk.decode() if isinstance(chunk, bytes) else chunk
-                    
-                    # Count tokens from streamed content (rough estimate: ~4 chars per token)
-                    if chunk_str.startswith("data: "):
-                        try:
-                            data_str = chunk_str[6:].strip()
-                            if data_str and data_str != "[DONE]":
-                                chunk_data = json.loads(data_str)
-                                if "choices" in chunk_data and len(chunk_data["choices"]) > 0:
-                                    delta = chunk_data["choices"][0].get("delta", {})
-                                    content = delta.get("content", "")
-                                    if content:
-                                        token_count += max(1, len(content) // 4)
-                        except:
-                            pass
-                    
-                    yield chunk_str
-        
-        # Append performance metrics after completion
-        elapsed = time.time() - start_time
-        if elapsed > 0 and token_count > 0:
-            tok_per_sec = token_count / elapsed
-            perf_message = f"\n\n[Performance: {tok_per_sec:.1f} tok/s | {token_count} tokens in {elapsed:.2f}s]"
-            yield create_sse({"choices": [{"delta": {"content": perf_message}, "index": 0}]})
-            logger.info(f"Performance: {tok_per_sec:.1f} tok/s ({token_count} tokens in {elapsed:.2f}s)")
-        
-        yield "data: [DONE]\n\n"
-    
-    return StreamingResponse(generate(), media_type="text/event-stream")
+        if fallback_for:
+            start_background_switch(fallback_for)
+        capture = Capture() if cache_key else None
+        async with aclosing(proxy_stream(model, body, path, record, capture, routes, report_model=bool(fallback_for))) as frames:
+            async for frame in frames:
+                yield frame
+        status = "ok"
+        if capture:
+            await response_cache.put(model, cache_key, capture.entry())
+    except Rejected as e:
+        status = "rejected"
+        yield create_sse({"error": {"message": str(e), "code": 429}})
+        yield SSE_DONE
+    except BackendStatusError as e:
+        status = "backend_error"
+        if record is not None:
+            record["backend_status"] = e.status_code
+        yield create_sse({"error": {"message": str(e), "code": e.status_code}})
+        yield SSE_DONE
+    except (asyncio.CancelledError, GeneratorExit):
+        status = "aborted"
+        ABORTED.inc(model)
+        raise
+    except httpx.HTTPError as e:
+        BACKEND_ERRORS.inc(MODELS[model]["backend"])
+        logger.error(f"Backend error while streaming {model}: {e!r}")
+        yield create_sse({"error": {"message": f"Backend error: {e!r}"}})
+        yield SSE_DONE
+    finally:
+        REQUESTS.inc(model, status)
+        request_log.end(record, status)
+        if leased:
+            lease.release(model)
+        admission.release(held)
+        if routes:
+            routes.release(model)
+
+async def until_disconnected(request, frames):
+    """Relay a streaming response, polling request.is_disconnected() meanwhile. A client that goes
+    away while nothing is being written (queued, waiting for a switch, prefill, a stalled backend)
+    cancels whatever the stream is waiting on, which closes the upstream request."""
+    task = asyncio.current_task()
+    waiting = disconnected = False
+
+    async def watch():
+        nonlocal disconnected
+        while not await request.is_disconnected():
+            await asyncio.sleep(DISCONNECT_POLL_INTERVAL)
+        disconnected = True
+        if waiting:  # mid-write, the failing send already ends the response
+            task.cancel()
+
+    watcher = asyncio.create_task(watch())
+    try:
+        while True:
+            waiting = True
+            try:
+                frame = await frames.__anext__()
+            except StopAsyncIteration:
+                break
+            finally:
+                waiting = False
+            yield frame
+            if disconnected:
+                break
+    except asyncio.CancelledError:
+        if not disconnected:
+            raise
+        # Python 3.11+ counts cancel() requests; 3.10 has no counter to undo
+        if uncancel := getattr(task, "uncancel", None):
+            uncancel()
+    finally:
+        watcher.cancel()
+        await frames.aclose()
+
+def supports(model, path, routes=None):
+    """Whether the model's backend declares the endpoint in its `endpoints` capability list"""
+    endpoints = (routes or routing).routes[model].endpoints
+    return "*" in endpoints or path in endpoints
+
+def refuse(model, path, routes=None):
+    """Error response for a request that cannot be accepted right now, else None"""
+    routes = routes or routing
+    if model not in routes.routes:
+        return error_response(404, f"Model {model} not found", type="invalid_request_error")
+    if not supports(model, path, routes):
+        return error_response(404, f"{path} is not supported by {model} ({routes.routes[model].backend})", type="invalid_request_error")
+    if lease.phase == "draining" and model in lease.evicting:
+        # Admitted now, it would be cut off when the grace period runs out
+        REQUESTS.inc(model, "rejected")
+        return error_response(503, f"Model {model} is being unloaded for a switch, retry shortly", retry_after=max(1, round(lease.grace)))
+    try:
+        admission.check(model)
+    except Rejected as e:
+        REQUESTS.inc(model, "rejected")
+        return error_response(429, str(e), retry_after=e.retry_after, type="rate_limit_error")
+    return None
+
+def fallback(model, path, routes):
+    """A warm model to answer for model while it is cold: the first of its `fallback` chain ("*" is any
+    resident model) that is loaded, not about to be evicted, serves path and has room; else None"""
+    chain = routes.routes[model].fallback
+    if not chain or lease.admissible(model) or not supports(model, path, routes):
+        return None
+    for entry in chain:
+        for candidate in (resident_models() if entry == "*" else [entry]):
+            if (candidate != model and candidate in routes.routes and supports(candidate, path, routes)
+                    and lease.admissible(candidate) and candidate not in lease.evicting
+                    and not any(limiter.full() for limiter in admission.chain(candidate))):
+                return candidate
+    return None
+
+def served_as(response, model):
+    """A backend JSON response with `model` set to the router's name for the model that answered"""
+    try:
+        payload = loads(response.body)
+    except ValueError:
+        return response
+    if not isinstance(payload, dict):
+        return response
+    payload["model"] = model
+    return Response(dumps(payload), status_code=response.status_code, media_type="application/json", headers={"X-Served-Model": model})
+
+# Whether a request is streamed when it leaves out "stream": chat keeps the router's historical
+# default, text completions follow OpenAI (JSON)
+STREAM_DEFAULTS = {"/v1/chat/completions": True, "/v1/completions": False}
+
+def streams(body, path):
+    """Whether to answer as SSE; other passed-through endpoints are always proxied as JSON"""
+    return path in STREAM_DEFAULTS and bool(body.get("stream", STREAM_DEFAULTS[path]))
+
+async def route(request, body, path):
+    """Route an OpenAI-style request to its model's backend, streaming or not"""
+    model = body.get("model")
+    routes = routing  # this request's routing table, even if the config is reloaded meanwhile
+    # Cache hits need neither the model nor an admission slot
+    key = response_cache.key(body, path) if model in routes.routes and routes.routes[model].cache else None
+    if key and (entry := await response_cache.get(model, key)):
+        REQUESTS.inc(model, "cached")
+        request_log.end(request_log.begin(model, body, path), "cached")
+        if not streams(body, path):
+            return JSONResponse(response_cache.json(model, path, entry), headers={"X-Served-Model": model})
+        return Response(response_cache.stream(model, body, path, entry), media_type="text/event-stream", headers={"X-Served-Model": model})
+    # A cold model with a fallback chain is loaded in the background while a warm model answers
+    requested = model
+    served = fallback(model, path, routes) if model in routes.routes else None
+    if served:
+        FALLBACKS.inc(model, served)
+        logger.info(f"{model} is not loaded; {served} answers while it loads")
+        model, body, key = served, {**body, "model": served}, None
+    refused = refuse(model, path, routes)
+    if refused:
+        return refused
+    prewarmer.observe(requested)
+    priority = admission.priority(request)
+    record = request_log.begin(model, body, path)
+    routes.checkout(model)
+    if not streams(body, path):
+        async def call():
+            if served:  # only now, so the switch drains this request instead of evicting its model first
+                start_background_switch(requested)
+            response = await proxy_json(model, body, path, record, routes)
+            if key and response.status_code == 200:
+                await response_cache.put(model, key, ResponseCache.from_json(response.body))
+            return served_as(response, model) if served and response.status_code == 200 else response
+        try:
+            response = await serve_json(model, call, priority, record)
+        finally:
+            routes.release(model)
+        response.headers["X-Served-Model"] = model
+        return response
+    return StreamingResponse(until_disconnected(request, generate(model, body, path, priority, record, key, routes, served and requested)),
+                             media_type="text/event-stream", headers={"X-Served-Model": model})
+
+@app.post("/v1/chat/completions")
+async def chat(request: Request):
+    body = loads(await request.body())
+    return await route(request, body, "/v1/chat/completions")
+
+@app.post("/v1/completions")
+async def completions(request: Request):
+    body = loads(await request.body())
+    return await route(request, body, "/v1/completions")
+
+@app.post("/v1/embeddings")
+async def embeddings(request: Request):
+    body = loads(await request.body())
+    model = body.get("model")
+    routes = routing
+    refused = refuse(model, "/v1/embeddings", routes)
+    if refused:
+        return refused
+    prewarmer.observe(model)
+    record = request_log.begin(model, body, "/v1/embeddings")
+    routes.checkout(model)
+    try:
+        if EMBEDDING_BATCH.get("enabled", True):
+            return await serve_json(model, lambda: embedder.embed(model, body, record, routes), admission.priority(request), record)
+        return await serve_json(model, lambda: proxy_json(model, body, "/v1/embeddings", record, routes), admission.priority(request), record)
+    finally:
+        routes.release(model)
+
+def unauthorized(request):
+    """401 response unless the request carries `admin_token` (when one is configured)"""
+    if ADMIN_TOKEN and request.headers.get("Authorization") != f"Bearer {ADMIN_TOKEN}":
+        return error_response(401, "Admin token required")
+    return None
+
+@app.post("/admin/preload")
+async def preload(request: Request):
+    """Load a model ahead of demand, e.g. from cron before working hours. {"model": ..., "wait": false}"""
+    denied = unauthorized(request)
+    if denied:
+        return denied
+    body = await request.json() if (await request.body()) else {}
+    model = body.get("model") or request.query_params.get("model")
+    if model not in MODELS:
+        return error_response(404, f"Model {model} not found", type="invalid_request_error")
+    if model in resident_models():
+        return {"model": model, "status": "loaded"}
+    PREWARMS.inc(model, "admin")
+    task = start_background_switch(model)
+    if not body.get("wait"):
+        return JSONResponse({"model": model, "status": "loading"}, status_code=202)
+    if await asyncio.shield(task):
+        return {"model": model, "status": "loaded"}
+    return error_response(503, f"Could not load {model}")
+
+@app.post("/admin/reload")
+async def reload(request: Request):
+    """Re-read config.json now (same as SIGHUP); 400 with the problems if it is invalid"""
+    denied = unauthorized(request)
+    if denied:
+        return denied
+    try:
+        return await reload_config("admin")
+    except ConfigError as e:
+        return error_response(400, str(e), type="invalid_request_error")
+
+@app.get("/metrics")
+async def metrics():
+    lines = [line for m in METRICS for line in m.render()]
+    lines.append("# HELP router_queue_depth Requests queued for a model that is not loaded\n# TYPE router_queue_depth gauge")
+    lines += [f'router_queue_depth{{{format_labels(("model",), (m,))}}} {len(lease.waiting.get(m, ()))}' for m in MODELS]
+    lines.append("# HELP router_active_requests Requests currently holding a model lease\n# TYPE router_active_requests gauge")
+    lines += [f'router_active_requests{{{format_labels(("model",), (m,))}}} {lease.active[m]}' for m in MODELS]
+    lines.append("# HELP router_admission_waiting Requests waiting for a concurrency slot\n# TYPE router_admission_waiting gauge")
+    lines += [f'router_admission_waiting{{{format_labels(("limit",), (n,))}}} {len(l.waiting)}' for n, l in admission.limiters.items()]
+    lines.append("# HELP router_model_loaded Whether a model is resident on its backend\n# TYPE router_model_loaded gauge")
+    lines += [f'router_model_loaded{{{format_labels(("model",), (m,))}}} {int(m in resident_models())}' for m in MODELS]
+    return PlainTextResponse("\n".join(lines) + "\n", media_type="text/plain; version=0.0.4")
 
 @app.get("/health")
 async def health():
-    return {"status": "healthy", "current_model": state["current_model"], "models": list(MODELS.keys())}
+    # Only check backends that are meant to be serving; a loading backend is left alone. No inference
+    # requests here: they would bypass admission and compete with real traffic on small-batch backends
+    loaded = state["loaded"] or {}
+    results = await asyncio.gather(*(liveness.check(b) for b in loaded))
+    return {"status": "healthy", "current_model": state["current_model"], "loaded_models": resident_models(),
+            "backends": dict(zip(loaded, results)),
+            "switching": lease.phase, "active_requests": dict(+lease.active), "queued": lease.queued(),
+            "replicas": {m: [{"url": r.url, "outstanding": r.outstanding, "down": r.down_until > time.monotonic()} for r in rs]
+                         for m, rs in routing.replicas.sets.items()},
+            "models": list(MODELS.keys()),
+            **({"workers": coordinator.totals()} if coordinator.path else {})}
+
+@app.api_route("/v1/{rest:path}", methods=["GET", "POST"])
+async def passthrough(request: Request, rest: str):
+    """Any other OpenAI-style endpoint, routed by the request's model (or the current model for GETs)"""
+    path = f"/v1/{rest}"
+    if request.method == "GET":
+        model = request.query_params.get("model") or state["current_model"]
+        if model not in MODELS or not supports(model, path):
+            return error_response(404, f"No loaded model serves GET {path}")
+        if not lease.admissible(model):
+            return error_response(503, f"Model {model} is not loaded", retry_after=30)
+        try:
+            r = await clients[MODELS[model]["backend"]].get(path, params=request.query_params)
+        except httpx.HTTPError as e:
+            BACKEND_ERRORS.inc(MODELS[model]["backend"])
+            return error_response(502, f"Backend error: {e!r}")
+        return Response(content=r.content, status_code=r.status_code, media_type=r.headers.get("content-type"))
+    body = loads(await request.body())
+    return await route(request, body, path)
 
 if __name__ == "__main__":
     logger.info("="*60)
     logger.info("Multi-Backend LLM Router v4.0.0 - Systemd Edition")
     logger.info(f"Models: {list(MODELS.keys())}")
+    # uvicorn's "auto" event loop and HTTP parser already pick uvloop and httptools when installed
+    fast = [name for name in ("orjson", "uvloop", "httptools") if importlib.util.find_spec(name)]
+    logger.info(f"Fast paths: {', '.join(fast) or 'none'}")
     logger.info("="*60)
-    uvicorn.run(app, host="0.0.0.0", port=ROUTER_PORT)
+    if WORKERS > 1:
+        # Each worker imports the app itself; they coordinate switches through COORDINATION["path"]
+        uvicorn.run("router:app", host="0.0.0.0", port=ROUTER_PORT, workers=WORKERS,
+                    app_dir=os.path.dirname(os.path.abspath(__file__)))
+    else:
+        uvicorn.run(app, host="0.0.0.0", port=ROUTER_PORT)
@@ -0,0 +1,70 @@
+#!/usr/bin/env python3
+"""Router CPU cost of turning SGLang /generate streams into OpenAI deltas.
+
+Times the whole receive path for 8k-32k token generations: raw SSE bytes arrive
+in 64 KB reads and are framed, decoded and turned into deltas. "v3 cumulative"
+is the v3 router's loop over a cumulative stream (str buffer split on blank
+lines, json.loads, startswith() against the previous text); "native" is
+router.SSEParser plus router.GenerateStream over an incremental stream, which
+is the only mode the router serves from /generate. Only the router's calls are
+timed; building the input is not.
+
+    ROUTER_CONFIG=config/config.json.example python3 scripts/bench_generate_deltas.py
+"""
+import codecs, json, os, sys, time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from router import GenerateStream, SSEParser  # noqa: E402
+
+TOKEN = b"word "  # ~1 token per event, as SGLang streams by default
+LENGTHS = (8192, 16384, 32768)
+READ_SIZE = 65536
+
+def reads(n, incremental):
+    """The raw response body of an n-token generation, in READ_SIZE pieces, built lazily
+    (a cumulative 32k-token stream is several GB)"""
+    buf, text = bytearray(), b""
+    for i in range(n):
+        text += TOKEN
+        meta = {"completion_tokens": i + 1, "prompt_tokens": 100}
+        if i == n - 1:
+            meta["finish_reason"] = {"type": "length", "length": n}
+        body = json.dumps({"text": (TOKEN if incremental else text).decode(), "meta_info": meta})
+        buf += b"data: " + body.encode() + b"\n\n"
+        while len(buf) >= READ_SIZE:
+            yield bytes(buf[:READ_SIZE])
+            del buf[:READ_SIZE]
+    yield bytes(buf + b"data: [DONE]\n\n")
+
+def v3(chunks):
+    decoder, buf, previous, cpu = codecs.getincrementaldecoder("utf-8")(), "", "", 0.0
+    for chunk in chunks:
+        start = time.process_time()
+        buf += decoder.decode(chunk)
+        *blocks, buf = buf.split("\n\n")
+        for block in blocks:
+            data = "\n".join(line[6:] for line in block.split("\n") if line.startswith("data: "))
+            if not data or data == "[DONE]":
+                continue
+            current = json.loads(data).get("text", "")
+            if current.startswith(previous):
+                new = current[len(previous):]
+                if new:
+                    previous = current
+        cpu += time.process_time() - start
+    return cpu
+
+def native(chunks):
+    parser, gen, cpu = SSEParser(), GenerateStream("bench", {"prompt": ""}), 0.0
+    for chunk in chunks:
+        start = time.process_time()
+        for data in parser.feed(chunk):
+            if data != b"[DONE]":
+                gen.translate(gen.parse(data))
+        cpu += time.process_time() - start
+    return cpu
+
+if __name__ == "__main__":
+    print(f"{'tokens':>7} {'v3 cumulative':>14} {'native':>10}   (CPU seconds)")
+    for n in LENGTHS:
+        print(f"{n:>7} {v3(reads(n, False)):>14.3f} {native(reads(n, True)):>10.3f}")
@@ -0,0 +1,120 @@
+#!/usr/bin/env python3
+"""Router CPU per 1,000 proxied tokens on the streaming pass-through path.
+
+Replays a 4k-token OpenAI-style completion (one event per network chunk, as
+backends send them) from a fake upstream response, so only the router's own
+work is timed. "legacy" is the pre-fast-path loop: str parsing, json.loads and a re-framed
+str for every event. "stdlib" and "orjson" run router.proxy_stream with each
+JSON library. Two cases: the backend sends a usage chunk (events are forwarded
+unparsed) and it does not (every event is parsed to count text).
+
+    ROUTER_CONFIG=config/config.json.example python3 scripts/bench_sse.py
+"""
+import asyncio, codecs, contextlib, gc, json, os, sys, time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+import router  # noqa: E402
+
+TOKENS = 4096
+ROUNDS = 10
+
+def events(n, usage):
+    """Pre-encoded SSE events of an n-token chat completion, one per network chunk"""
+    base = {"id": "chatcmpl-bench", "object": "chat.completion.chunk", "created": 1792000000, "model": "bench"}
+    out = [f"data: {json.dumps({**base, 'choices': [{'index': 0, 'delta': {'content': 'word '}, 'finish_reason': None}]})}\n\n"
+           for _ in range(n)]
+    out.append(f"data: {json.dumps({**base, 'choices': [{'index': 0, 'delta': {}, 'finish_reason': 'length'}]})}\n\n")
+    if usage:
+        out.append(f"data: {json.dumps({**base, 'choices': [], 'usage': {'prompt_tokens': 100, 'completion_tokens': n}})}\n\n")
+    out.append("data: [DONE]\n\n")
+    return [e.encode() for e in out]
+
+class Upstream:
+    """Stands in for the pooled httpx client: every stream() replays chunks, with no HTTP work to time"""
+    def __init__(self, chunks):
+        self.chunks = chunks
+        self.status_code = 200
+
+    @contextlib.asynccontextmanager
+    async def stream(self, method, path, **kwargs):
+        yield self
+
+    async def aiter_bytes(self):
+        for chunk in self.chunks:
+            yield chunk
+
+async def legacy(chunks, stream_usage):
+    """The pre-fast-path pass-through: decode, parse and re-frame every event as str"""
+    decoder, buf = codecs.getincrementaldecoder("utf-8")(errors="replace"), ""
+    stats = router.StreamStats("bench")
+    queue = asyncio.Queue(maxsize=router.STREAM_QUEUE_SIZE)
+    body = {"model": "bench", "messages": [], "stream": True, "stream_options": {"include_usage": stream_usage}}
+    async with Upstream(chunks).stream("POST", "/v1/chat/completions", content=json.dumps(body).encode()) as r:
+        pump = asyncio.create_task(router.pump_stream(r, queue))
+        while (item := await queue.get()) is not None:
+            arrived, chunk = item
+            buf += decoder.decode(chunk)
+            *blocks, buf = buf.split("\n\n")
+            frames = []
+            for block in blocks:
+                data = "\n".join(line[6:] for line in block.split("\n") if line.startswith("data: "))
+                if not data or data == "[DONE]":
+                    continue
+                chunk_data = json.loads(data)
+                stats.observe(chunk_data, arrived)
+                if not chunk_data.get("choices") and "usage" in chunk_data:
+                    continue
+                frames.append(f"data: {data}\n\n")
+            if frames:
+                "".join(frames).encode()
+        await pump
+    await stats.finish()
+
+class Routes:
+    """Just enough of router.RoutingTable for proxy_stream: one route, one mock client"""
+    def __init__(self, chunks, stream_usage):
+        self.chunks = chunks
+        self.routes = {"bench": router.Route("sglang", "http://bench", None, False, None, stream_usage, False, ())}
+        self.replicas = self
+
+    async def stream(self, stack, model, body, method, path, **kwargs):
+        upstream = Upstream(self.chunks)
+        return upstream, await stack.enter_async_context(upstream.stream(method, path, **kwargs))
+
+async def current(chunks, stream_usage):
+    body = {"model": "bench", "messages": []}
+    async for frame in router.proxy_stream("bench", body, routes=Routes(chunks, stream_usage)):
+        pass
+
+def timed(fn, chunks, stream_usage):
+    """Best-of-ROUNDS CPU seconds, scaled to 1,000 tokens (garbage collection off, as timeit does)"""
+    best = float("inf")
+    for _ in range(ROUNDS):
+        gc.collect()
+        gc.disable()
+        start = time.process_time()
+        asyncio.run(fn(chunks, stream_usage))
+        best = min(best, time.process_time() - start)
+        gc.enable()
+    return best * 1000 / TOKENS
+
+def with_json(library, fn):
+    def run(*args):
+        router.dumps, router.loads = library
+        return fn(*args)
+    return run
+
+if __name__ == "__main__":
+    router.logger.disabled = True
+    # router's stdlib fallback, whether or not orjson is installed
+    stdlib = (lambda obj: json.dumps(obj, ensure_ascii=False, separators=(",", ":")).encode(),
+              lambda data: json.loads(data.decode() if isinstance(data, bytes) else data))
+    libraries = {"stdlib": stdlib}
+    if router.orjson:
+        libraries["orjson"] = (router.orjson.dumps, router.orjson.loads)
+    print(f"{'backend stream':>16} {'legacy':>9}" + "".join(f" {name:>9}" for name in libraries) + "   (CPU ms per 1k tokens)")
+    for stream_usage in (True, False):
+        chunks = events(TOKENS, stream_usage)
+        row = [timed(legacy, chunks, stream_usage)]
+        row += [timed(with_json(library, current), chunks, stream_usage) for library in libraries.values()]
+        print(f"{'with usage' if stream_usage else 'no usage':>16}" + "".join(f" {t * 1000:>9.1f}" for t in row))
@@ -0,0 +1,202 @@
+#!/usr/bin/env python3
+"""Fake SGLang, TabbyAPI and llama.cpp servers for running the router offline.
+
+Each backend streams "tok " chunks at --tps tokens/s per request (prefill at
+--prefill-tps prompt tokens/s, at most --max-batch requests at a time) and
+reports usage the way the real server does: OpenAI usage chunks, llama.cpp
+timings, SGLang /generate meta_info (/generate text is cumulative unless
+--incremental-output, or `incremental_output` on the sglang backend of --config). Loading takes --load-time seconds, during
+which /health and inference return 503:
+
+  - sglang / llamacpp reload on POST /mock/start (POST /mock/stop unloads),
+    which the router triggers through `service_commands` with the external
+    service manager (see docs/REPLAY.md);
+  - tabbyapi loads through its admin API (/v1/model/load, /v1/model/unload).
+
+Start every backend listed in a router config:
+
+    python3 scripts/mock_backend.py --config config.json --load-time 20 --tps 60
+
+or a single one: --kind sglang --port 30000.
+"""
+import argparse, asyncio, json, time
+
+import uvicorn
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, StreamingResponse
+
+CHARS_PER_TOKEN = 4
+
+def sse(data):
+    return f"data: {json.dumps(data)}\n\n"
+
+class MockBackend:
+    def __init__(self, kind, load_time, tps, prefill_tps, max_batch, incremental=False):
+        self.kind, self.load_time, self.tps, self.prefill_tps = kind, load_time, tps, prefill_tps
+        self.incremental = incremental
+        self.batch = asyncio.Semaphore(max_batch)
+        self.ready_at = time.time()  # running from the start, like an already-started service
+        self.model = None
+        self.starts = 0
+
+    def ready(self):
+        return time.time() >= self.ready_at
+
+    def start(self, model=None):
+        self.ready_at = time.time() + self.load_time
+        self.model = model
+        self.starts += 1
+
+    def stop(self):
+        self.ready_at = float("inf")
+
+    def app(self):
+        app = FastAPI()
+        unavailable = lambda: JSONResponse({"error": "model not loaded"}, status_code=503)
+
+        @app.get("/health")
+        async def health():
+            return {"status": "ok"} if self.ready() else unavailable()
+
+        @app.post("/mock/start")
+        async def mock_start():
+            self.start()
+            return {"ready_in": self.load_time}
+
+        @app.post("/mock/stop")
+        async def mock_stop():
+            self.stop()
+            return {}
+
+        @app.get("/mock/stats")
+        async def mock_stats():
+            return {"kind": self.kind, "ready": self.ready(), "starts": self.starts, "model": self.model}
+
+        @app.post("/v1/chat/completions")
+        @app.post("/v1/completions")
+        async def completions(request: Request):
+            if not self.ready():
+                return unavailable()
+            body = await request.json()
+            chat = "messages" in body
+            prompt = "".join(m.get("content") or "" for m in body["messages"] if isinstance(m.get("content"), str)) if chat else str(body.get("prompt", ""))
+            prompt_tokens = max(1, len(prompt) // CHARS_PER_TOKEN)
+            n = body.get("max_tokens") or body.get("max_completion_tokens") or 16
+            if not body.get("stream"):
+                async with self.batch:
+                    await asyncio.sleep(prompt_tokens / self.prefill_tps + n / self.tps)
+                choice = {"index": 0, "finish_reason": "length"}
+                choice.update({"message": {"role": "assistant", "content": "tok " * n}} if chat else {"text": "tok " * n})
+                return {"id": "mock", "object": "chat.completion" if chat else "text_completion", "model": body.get("model"),
+                        "choices": [choice], "usage": {"prompt_tokens": prompt_tokens, "completion_tokens": n, "total_tokens": prompt_tokens + n}}
+            return StreamingResponse(self.stream(body, chat, prompt_tokens, n), media_type="text/event-stream")
+
+        @app.post("/generate")
+        async def generate(request: Request):
+            if self.kind != "sglang" or not self.ready():
+                return unavailable()
+            body = await request.json()
+            prompt_tokens = max(1, len(body.get("text", "")) // CHARS_PER_TOKEN)
+            n = body.get("sampling_params", {}).get("max_new_tokens", 16)
+            async def events():
+                async with self.batch:
+                    await asyncio.sleep(prompt_tokens / self.prefill_tps)
+                    for i in range(n):
+                        meta = {"prompt_tokens": prompt_tokens, "completion_tokens": i + 1,
+                                "finish_reason": {"type": "length", "length": n} if i == n - 1 else None}
+                        yield sse({"text": "tok " if self.incremental else "tok " * (i + 1), "meta_info": meta})
+                        await asyncio.sleep(1 / self.tps)
+                yield "data: [DONE]\n\n"
+            return StreamingResponse(events(), media_type="text/event-stream")
+
+        @app.post("/v1/embeddings")
+        async def embeddings(request: Request):
+            if not self.ready():
+                return unavailable()
+            body = await request.json()
+            inputs = [body["input"]] if isinstance(body["input"], str) else body["input"]
+            return {"object": "list", "model": body.get("model"), "usage": {"prompt_tokens": len(inputs), "total_tokens": len(inputs)},
+                    "data": [{"object": "embedding", "index": i, "embedding": [0.0] * 8} for i in range(len(inputs))]}
+
+        @app.post("/abort_request")
+        async def abort(request: Request):
+            return {}
+
+        @app.get("/v1/model")
+        async def current_model():
+            if self.kind != "tabbyapi" or not self.model or not self.ready():
+                return JSONResponse({"error": "no model loaded"}, status_code=400)
+            return {"id": self.model}
+
+        @app.post("/v1/model/unload")
+        async def unload():
+            self.stop()
+            return {}
+
+        @app.post("/v1/model/load")
+        async def load(request: Request):
+            body = await request.json()
+            self.start(body.get("model_name"))
+            async def progress():
+                modules = 10
+                for i in range(1, modules + 1):
+                    await asyncio.sleep(self.load_time / modules)
+                    yield sse({"model_type": "model", "module": i, "modules": modules,
+                               "status": "finished" if i == modules else "processing"})
+            return StreamingResponse(progress(), media_type="text/event-stream")
+
+        return app
+
+    async def stream(self, body, chat, prompt_tokens, n):
+        start = time.time()
+        async with self.batch:
+            await asyncio.sleep(prompt_tokens / self.prefill_tps)
+            prefill_done = time.time()
+            for _ in range(n):
+                choice = {"index": 0, "delta": {"content": "tok "}} if chat else {"index": 0, "text": "tok "}
+                yield sse({"choices": [choice]})
+                await asyncio.sleep(1 / self.tps)
+        decode = time.time() - prefill_done
+        final = {"choices": [{"index": 0, "delta": {}, "finish_reason": "length"}]} if chat else \
+                {"choices": [{"index": 0, "text": "", "finish_reason": "length"}]}
+        if self.kind == "llamacpp":
+            final["timings"] = {"prompt_n": prompt_tokens, "prompt_ms": (prefill_done - start) * 1000,
+                                "prompt_per_second": prompt_tokens / max(prefill_done - start, 1e-6),
+                                "predicted_n": n, "predicted_ms": decode * 1000}
+        yield sse(final)
+        if (body.get("stream_options") or {}).get("include_usage"):
+            yield sse({"choices": [], "usage": {"prompt_tokens": prompt_tokens, "completion_tokens": n, "total_tokens": prompt_tokens + n}})
+        yield "data: [DONE]\n\n"
+
+async def serve(specs, args):
+    servers = []
+    for kind, port, incremental in specs:
+        backend = MockBackend(kind, args.load_time, args.tps, args.prefill_tps, args.max_batch, incremental)
+        config = uvicorn.Config(backend.app(), host=args.host, port=port, log_level="warning")
+        servers.append(uvicorn.Server(config))
+        print(f"mock {kind} on {args.host}:{port} (load {args.load_time}s, {args.tps} tok/s)", flush=True)
+    await asyncio.gather(*(s.serve() for s in servers))
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--config", help="router config.json: start a mock for every backend in it")
+    parser.add_argument("--kind", choices=("sglang", "tabbyapi", "llamacpp"))
+    parser.add_argument("--port", type=int)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--load-time", type=float, default=10.0, help="seconds to load a model")
+    parser.add_argument("--tps", type=float, default=50.0, help="decode tokens/s per request")
+    parser.add_argument("--prefill-tps", type=float, default=2000.0, help="prompt tokens/s")
+    parser.add_argument("--max-batch", type=int, default=8, help="requests generated concurrently")
+    parser.add_argument("--incremental-output", action="store_true", help="sglang /generate streams only new text")
+    args = parser.parse_args()
+    if args.config:
+        backends = json.load(open(args.config)).get("backends", {})
+        defaults = {"sglang": 30000, "tabbyapi": 5000, "llamacpp": 8085}
+        specs = [(kind, backends[kind].get("port", defaults[kind]),
+                  args.incremental_output or backends[kind].get("incremental_output", False))
+                 for kind in defaults if kind in backends]
+    elif args.kind and args.port:
+        specs = [(args.kind, args.port, args.incremental_output)]
+    else:
+        parser.error("give --config or --kind and --port")
+    asyncio.run(serve(specs, args))
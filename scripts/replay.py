@@ -0,0 +1,206 @@
+#!/usr/bin/env python3
+"""Replay a request trace against the router and report latency, throughput and switches.
+
+The trace is the router's request log (`request_log.path` in config.json) or a
+synthetic one. Requests are sent at their recorded offsets divided by --speed
+(--speed 0 sends everything at once) to the recorded endpoint, streaming or
+not as recorded, with the recorded prompt size and output length.
+
+    python3 scripts/replay.py requests.jsonl --url http://localhost:8002 --speed 10
+    python3 scripts/replay.py --synthetic 200 --models a,b,c --rate 2 --switch-prob 0.2
+
+Switch counts come from the router's /metrics (model switches that completed)
+and from the responses (requests that had to wait for one). Pair it with
+scripts/mock_backend.py to compare scheduler and placement settings offline.
+"""
+import argparse, asyncio, json, random, re, sys, time
+
+import httpx
+
+STATUS_PREFIXES = ("🔄", "⏳", "✅", "❌")
+FOOTER = re.compile(r"\[Performance: .*\| (\d+) tokens in")
+SWITCH_COUNT = re.compile(r'^router_model_switch_seconds_count\{model="([^"]+)",phase="ready"\} (\S+)$', re.M)
+
+def load_trace(path, limit=None):
+    entries = []
+    with open(path) as f:
+        for line in f:
+            if line.strip():
+                entries.append(json.loads(line))
+    entries.sort(key=lambda e: e["ts"])
+    return entries[:limit] if limit else entries
+
+def synthetic_trace(n, models, rate, switch_prob, prompt_chars, max_tokens, seed):
+    """Poisson arrivals; each request stays on the previous model unless it switches with switch_prob"""
+    rng = random.Random(seed)
+    t, model, entries = 0.0, models[0], []
+    for _ in range(n):
+        t += rng.expovariate(rate)
+        if rng.random() < switch_prob:
+            model = rng.choice([m for m in models if m != model] or models)
+        entries.append({"ts": t, "model": model, "endpoint": "/v1/chat/completions", "stream": True,
+                        "prompt_chars": int(rng.uniform(0.5, 1.5) * prompt_chars), "max_tokens": max_tokens})
+    return entries
+
+def percentile(values, p):
+    if not values:
+        return float("nan")
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(p / 100 * (len(values) - 1))))]
+
+async def switch_counts(client):
+    try:
+        text = (await client.get("/metrics")).text
+    except httpx.HTTPError:
+        return {}
+    return {m: float(v) for m, v in SWITCH_COUNT.findall(text)}
+
+def request_body(entry, default_tokens):
+    """A request shaped like the recorded one: endpoint, streaming, prompt size and output length"""
+    endpoint = entry.get("endpoint", "/v1/chat/completions")
+    text = "x" * entry.get("prompt_chars", 0)
+    body = {"model": entry["model"]}
+    if endpoint == "/v1/embeddings":
+        return endpoint, False, {**body, "input": text}
+    if endpoint == "/v1/chat/completions":
+        body["messages"] = [{"role": "user", "content": text}]
+    else:
+        body["prompt"] = text
+    body["max_tokens"] = entry.get("max_tokens") or entry.get("tokens") or default_tokens
+    stream = entry.get("stream", True)
+    body["stream"] = stream
+    return endpoint, stream, body
+
+async def read_stream(r, result, start):
+    """Fill result from an SSE response: status lines, first content (ttft), the footer's token count"""
+    buffer = ""
+    async for text in r.aiter_text():
+        buffer += text
+        *events, buffer = buffer.split("\n\n")
+        for event in events:
+            if not event.startswith("data: ") or event == "data: [DONE]":
+                continue
+            data = json.loads(event[6:])
+            if "error" in data:
+                result["error"] = data["error"].get("message")
+                continue
+            for choice in data.get("choices", []):
+                content = (choice.get("delta") or {}).get("content") or choice.get("text") or ""
+                if content.startswith(STATUS_PREFIXES):
+                    result["switched"] |= content.startswith("🔄")
+                elif (m := FOOTER.search(content)):
+                    result["tokens"] = int(m.group(1))
+                elif content and result["ttft"] is None:
+                    result["ttft"] = time.perf_counter() - start
+
+def read_json(r, result):
+    """Fill result from a JSON response: the error message, or the output tokens from `usage`"""
+    try:
+        data = r.json()
+    except ValueError:
+        data = None
+    if not isinstance(data, dict):
+        data = {}
+    if r.status_code != 200:
+        result["error"] = (data.get("error") or {}).get("message") or f"HTTP {r.status_code}"
+    else:
+        result["tokens"] = (data.get("usage") or {}).get("completion_tokens") or 0
+
+async def send(client, entry, default_tokens):
+    """One request; returns a result dict with latency, ttft, tokens and whether it waited for a switch
+    (JSON responses have no status lines or first token, so only streams report those)"""
+    endpoint, stream, body = request_body(entry, default_tokens)
+    start = time.perf_counter()
+    result = {"model": entry["model"], "ok": False, "switched": False, "ttft": None, "tokens": 0}
+    try:
+        if stream:
+            async with client.stream("POST", endpoint, json=body) as r:
+                result["status"] = r.status_code
+                await read_stream(r, result, start)
+        else:
+            r = await client.post(endpoint, json=body)
+            result["status"] = r.status_code
+            read_json(r, result)
+        result["ok"] = r.status_code == 200 and "error" not in result
+    except httpx.HTTPError as e:
+        result["error"] = repr(e)
+    result["latency"] = time.perf_counter() - start
+    return result
+
+async def replay(entries, args):
+    limits = httpx.Limits(max_connections=args.max_connections, max_keepalive_connections=args.max_connections)
+    async with httpx.AsyncClient(base_url=args.url, timeout=httpx.Timeout(None), limits=limits) as client:
+        before = await switch_counts(client)
+        t0, base = time.perf_counter(), entries[0]["ts"]
+
+        async def scheduled(entry):
+            if args.speed > 0:
+                await asyncio.sleep(max(0.0, (entry["ts"] - base) / args.speed - (time.perf_counter() - t0)))
+            return await send(client, entry, args.max_tokens)
+
+        results = await asyncio.gather(*(scheduled(e) for e in entries))
+        elapsed = time.perf_counter() - t0
+        after = await switch_counts(client)
+    switches = {m: after[m] - before.get(m, 0) for m in after if after[m] - before.get(m, 0)}
+    return results, elapsed, switches
+
+def report(results, elapsed, switches):
+    ok = [r for r in results if r["ok"]]
+    latencies = [r["latency"] for r in ok]
+    ttfts = [r["ttft"] for r in ok if r["ttft"] is not None]
+    tokens = sum(r["tokens"] for r in ok)
+    errors = {}
+    for r in results:
+        if not r["ok"]:
+            key = r.get("error") or f"HTTP {r.get('status')}"
+            errors[key[:80]] = errors.get(key[:80], 0) + 1
+    return {"requests": len(results), "ok": len(ok), "errors": errors, "duration_s": round(elapsed, 2),
+            "throughput_rps": round(len(ok) / elapsed, 3) if elapsed else 0.0,
+            "throughput_tok_s": round(tokens / elapsed, 1) if elapsed else 0.0,
+            "latency_s": {f"p{p}": round(percentile(latencies, p), 3) for p in (50, 95, 99)},
+            "ttft_s": {f"p{p}": round(percentile(ttfts, p), 3) for p in (50, 95, 99)},
+            "switches": {"completed": int(sum(switches.values())), "by_model": {m: int(n) for m, n in switches.items()},
+                         "requests_waited": sum(r["switched"] for r in results)}}
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("trace", nargs="?", help="request log (JSON lines) to replay")
+    parser.add_argument("--url", default="http://localhost:8002")
+    parser.add_argument("--speed", type=float, default=1.0, help="time scale: 2 = twice as fast, 0 = all at once")
+    parser.add_argument("--limit", type=int, help="replay only the first N requests")
+    parser.add_argument("--max-tokens", type=int, default=128, help="output length when the trace has none")
+    parser.add_argument("--max-connections", type=int, default=256)
+    parser.add_argument("--json", action="store_true", help="print the report as JSON")
+    synthetic = parser.add_argument_group("synthetic trace")
+    synthetic.add_argument("--synthetic", type=int, metavar="N", help="generate N requests instead of reading a trace")
+    synthetic.add_argument("--models", help="comma-separated models to spread the synthetic trace over")
+    synthetic.add_argument("--rate", type=float, default=1.0, help="requests per second")
+    synthetic.add_argument("--switch-prob", type=float, default=0.1, help="chance that a request changes model")
+    synthetic.add_argument("--prompt-chars", type=int, default=2000)
+    synthetic.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    if args.synthetic:
+        if not args.models:
+            parser.error("--synthetic needs --models")
+        entries = synthetic_trace(args.synthetic, args.models.split(","), args.rate, args.switch_prob,
+                                  args.prompt_chars, args.max_tokens, args.seed)
+    elif args.trace:
+        entries = load_trace(args.trace, args.limit)
+    else:
+        parser.error("give a trace file or --synthetic N")
+    if not entries:
+        sys.exit("empty trace")
+
+    summary = report(*asyncio.run(replay(entries, args)))
+    if args.json:
+        print(json.dumps(summary, indent=2))
+    else:
+        print(f"{summary['ok']}/{summary['requests']} ok in {summary['duration_s']}s: "
+              f"{summary['throughput_rps']} req/s, {summary['throughput_tok_s']} tok/s")
+        for name in ("latency_s", "ttft_s"):
+            print(f"{name[:-2]:>8}: " + "  ".join(f"{k} {v:.3f}s" for k, v in summary[name].items()))
+        print(f"switches: {summary['switches']['completed']} completed {summary['switches']['by_model']}, "
+              f"{summary['switches']['requests_waited']} requests waited for one")
+        for error, n in summary["errors"].items():
+            print(f"  {n} x {error}")
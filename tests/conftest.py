@@ -0,0 +1,72 @@
+import json, os, socket, subprocess, sys, time
+
+import httpx
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+# router reads its config at import time
+os.environ.setdefault("ROUTER_CONFIG", os.path.join(ROOT, "config", "config.json.example"))
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+def wait_for(url, timeout=20):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            if httpx.get(url, timeout=1).status_code < 500:
+                return
+        except httpx.HTTPError:
+            pass
+        time.sleep(0.1)
+    raise RuntimeError(f"{url} did not come up")
+
+@pytest.fixture(scope="session")
+def stack(tmp_path_factory):
+    """A router on scripts/mock_backend.py backends, started and stopped through the external
+    service manager's service_commands as systemd would. Yields the router's base URL."""
+    tmp = tmp_path_factory.mktemp("stack")
+    sglang, llamacpp, router_port = free_port(), free_port(), free_port()
+    mock = "import sys, urllib.request as u; u.urlopen(u.Request('http://127.0.0.1:{port}/mock/' + sys.argv[1], method='POST'))"
+    config = {
+        "router_port": router_port,
+        "model_load_timeout": 20,
+        "switch_grace_period": 2,
+        "scheduler": {"policy": "fifo"},  # switch (and start draining) as soon as a request is queued
+        "service_manager": "external",
+        "service_commands": {action: f'{sys.executable} -c "{mock}" {action}' for action in ("start", "stop")},
+        "backends": {
+            "sglang": {"port": sglang, "health_endpoint": "/health"},
+            "llamacpp": {"port": llamacpp, "health_endpoint": "/health",
+                         "endpoints": ["/v1/chat/completions", "/v1/completions", "/v1/embeddings"]},
+        },
+        "models": {
+            "a": {"backend": "sglang", "model_path": "/models/a"},
+            "a2": {"backend": "sglang", "model_path": "/models/a2"},
+            "b": {"backend": "llamacpp", "model_path": "/models/b"},
+        },
+        "embedding_batch": {"window_ms": 100},
+        "request_log": {"path": str(tmp / "requests.log")},
+        "tabby_config_path": str(tmp / "tabby.yml"),
+    }
+    path = tmp / "config.json"
+    path.write_text(json.dumps(config))
+    log = open(tmp / "stack.log", "w")
+    mocks = subprocess.Popen([sys.executable, os.path.join(ROOT, "scripts", "mock_backend.py"), "--config", str(path),
+                              "--load-time", "0.3", "--tps", "200"], stdout=log, stderr=subprocess.STDOUT)
+    router = subprocess.Popen([sys.executable, os.path.join(ROOT, "router.py")], env={**os.environ, "ROUTER_CONFIG": str(path)},
+                              stdout=log, stderr=subprocess.STDOUT)
+    try:
+        wait_for(f"http://127.0.0.1:{sglang}/mock/stats")
+        wait_for(f"http://127.0.0.1:{llamacpp}/mock/stats")
+        wait_for(f"http://127.0.0.1:{router_port}/v1/models")
+        yield {"url": f"http://127.0.0.1:{router_port}", "sglang": f"http://127.0.0.1:{sglang}",
+               "llamacpp": f"http://127.0.0.1:{llamacpp}", "request_log": tmp / "requests.log"}
+    finally:
+        for p in (router, mocks):
+            p.terminate()
+            p.wait(10)
+        log.close()
@@ -0,0 +1,59 @@
+import asyncio
+
+import pytest
+
+import router
+
+def test_limiter_serves_by_priority_then_fifo():
+    async def scenario():
+        limiter = router.Limiter("m", 1, 8, 5)
+        await limiter.acquire(1)
+        order = []
+        async def request(name, priority):
+            await limiter.acquire(priority)
+            order.append(name)
+        tasks = [asyncio.create_task(request(name, priority))
+                 for name, priority in (("low", 2), ("normal-1", 1), ("high", 0), ("normal-2", 1))]
+        await asyncio.sleep(0)
+        for _ in tasks:
+            limiter.release()
+            await asyncio.sleep(0)
+        await asyncio.gather(*tasks)
+        return order
+    assert asyncio.run(scenario()) == ["high", "normal-1", "normal-2", "low"]
+
+def test_limiter_rejects_when_queue_full():
+    async def scenario():
+        limiter = router.Limiter("m", 1, 1, 5)
+        await limiter.acquire(1)
+        waiter = asyncio.create_task(limiter.acquire(1))
+        await asyncio.sleep(0)
+        with pytest.raises(router.Rejected):
+            await limiter.acquire(0)
+        limiter.release()
+        await waiter
+        assert limiter.active == 1
+    asyncio.run(scenario())
+
+def test_limiter_times_out_and_leaves_the_queue():
+    async def scenario():
+        limiter = router.Limiter("m", 1, 4, 0.05)
+        await limiter.acquire(1)
+        with pytest.raises(router.Rejected):
+            await limiter.acquire(1)
+        assert limiter.waiting == []
+    asyncio.run(scenario())
+
+def test_backend_slot_is_separate_from_model_slot():
+    model = next(m for m, info in router.MODELS.items() if info["backend"] == "sglang")
+    async def scenario():
+        admission = router.Admission({})
+        admission.limiters = {model: router.Limiter(model, 4, 4, 5), "sglang": router.Limiter("sglang", 1, 4, 5)}
+        # Taken before the lease: only the model's own limit
+        held = await admission.acquire(model, 1)
+        assert [l.name for l in held] == [model] and admission.limiters["sglang"].active == 0
+        held += await admission.acquire(model, 1, backend=True)
+        assert admission.limiters["sglang"].active == 1
+        admission.release(held)
+        assert admission.limiters[model].active == admission.limiters["sglang"].active == 0
+    asyncio.run(scenario())
@@ -0,0 +1,36 @@
+import asyncio
+
+import router
+
+BODY = {"model": "m", "temperature": 0, "max_tokens": 8, "messages": [{"role": "user", "content": "hi"}]}
+
+def test_key_ignores_streaming_options_only():
+    cache = router.ResponseCache({})
+    key = cache.key(BODY, "/v1/chat/completions")
+    assert key is not None
+    assert cache.key({**BODY, "stream": True, "stream_options": {"include_usage": True}, "user": "u"}, "/v1/chat/completions") == key
+    assert cache.key({**BODY, "max_tokens": 9}, "/v1/chat/completions") != key
+    assert cache.key(BODY, "/v1/completions") != key
+
+def test_uncacheable_requests_have_no_key():
+    cache = router.ResponseCache({})
+    for extra in ({"temperature": 0.7}, {"n": 2}, {"logprobs": True}, {"top_logprobs": 2}, {"echo": True}):
+        assert cache.key({**BODY, **extra}, "/v1/chat/completions") is None
+    assert cache.key(BODY, "/v1/embeddings") is None
+
+def test_hit_and_miss():
+    async def scenario():
+        cache = router.ResponseCache({})
+        key = cache.key(BODY, "/v1/chat/completions")
+        assert await cache.get("m", key) is None
+        entry = {"pieces": [["c", "hello"]], "finish_reason": "stop", "usage": {"completion_tokens": 1}}
+        await cache.put("m", key, entry)
+        assert await cache.get("m", key) == entry
+        assert await cache.get("m", cache.key({**BODY, "max_tokens": 9}, "/v1/chat/completions")) is None
+    asyncio.run(scenario())
+
+def test_hits_get_fresh_ids():
+    cache = router.ResponseCache({})
+    entry = {"pieces": [["c", "hello"]], "finish_reason": "stop", "usage": None}
+    ids = {cache.json("m", "/v1/chat/completions", entry)["id"] for _ in range(2)}
+    assert len(ids) == 2 and all(i.startswith("chatcmpl-") for i in ids)
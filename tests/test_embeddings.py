@@ -0,0 +1,36 @@
+import asyncio, json, time
+
+import httpx
+
+import router
+
+def test_split_rebases_indices_and_shares_usage():
+    response = router.JSONResponse({"object": "list", "data": [{"index": i, "embedding": [float(i)]} for i in range(3)],
+                                    "usage": {"prompt_tokens": 30, "total_tokens": 30}})
+    records = [{}, {}]
+    one, two = router.EmbeddingBatcher.split(response, [(["aaaa"], None, records[0]), (["aaaa", "aaaa"], None, records[1])])
+    one, two = router.loads(one.body), router.loads(two.body)
+    assert [(d["index"], d["embedding"]) for d in one["data"]] == [(0, [0.0])]
+    assert [(d["index"], d["embedding"]) for d in two["data"]] == [(0, [1.0]), (1, [2.0])]
+    assert (one["usage"]["prompt_tokens"], two["usage"]["prompt_tokens"]) == (10, 20)
+    assert records == [{"prompt_tokens": 10}, {"prompt_tokens": 20}]
+
+def test_split_fans_out_errors():
+    error = router.error_response(502, "down")
+    assert router.EmbeddingBatcher.split(error, [([1], None, None), ([2], None, None)]) == [error, error]
+
+def test_concurrent_requests_are_batched_and_split(stack):
+    async def scenario():
+        async with httpx.AsyncClient(base_url=stack["url"], timeout=30) as client:
+            await client.post("/v1/embeddings", json={"model": "b", "input": "warm up"})
+            inputs = [["x"], ["y", "z"], "w"]
+            return inputs, await asyncio.gather(*(client.post("/v1/embeddings", json={"model": "b", "input": i}) for i in inputs))
+    inputs, responses = asyncio.run(scenario())
+    for sent, response in zip(inputs, responses):
+        assert response.status_code == 200
+        data = response.json()["data"]
+        assert [d["index"] for d in data] == list(range(1 if isinstance(sent, str) else len(sent)))
+    time.sleep(1.5)  # request log flush interval
+    records = [json.loads(line) for line in stack["request_log"].read_text().splitlines()]
+    # The mock counts one prompt token per input; each caller is logged with its share
+    assert sorted(r["prompt_tokens"] for r in records if r["endpoint"] == "/v1/embeddings")[-3:] == [1, 1, 2]
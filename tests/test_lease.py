@@ -0,0 +1,111 @@
+import asyncio, json, time
+
+import httpx
+import pytest
+
+import router
+
+# Models of the example config, one per backend
+BY_BACKEND = {info["backend"]: model for model, info in router.MODELS.items()}
+A, B, C = BY_BACKEND["sglang"], BY_BACKEND["llamacpp"], BY_BACKEND["tabbyapi"]
+
+@pytest.fixture
+def loaded(monkeypatch):
+    monkeypatch.setitem(router.state, "loaded", {"sglang": A})
+    monkeypatch.setitem(router.state, "current_model", A)
+
+async def settle():
+    """Let granted waiters wake up"""
+    for _ in range(5):
+        await asyncio.sleep(0)
+
+async def switch(lease, model):
+    async for _ in lease.drain():
+        pass
+    lease.switched(model)
+
+def test_queued_requests_are_served_in_order(loaded):
+    async def scenario():
+        lease = router.ModelLease(1, router.FifoPolicy(), router.Placement({}))
+        assert await lease.acquire(A) is False
+        first_b = asyncio.create_task(lease.acquire(B))
+        c = asyncio.create_task(lease.acquire(C))
+        second_b = asyncio.create_task(lease.acquire(B))
+        await settle()
+        # The oldest request performs the switch; the rest wait for it
+        assert first_b.done() and first_b.result() is True
+        assert not c.done() and not second_b.done()
+        assert lease.evicting == [A]
+        lease.release(A)
+        await switch(lease, B)
+        await settle()
+        # Requests for the model just loaded join it; the next model's oldest request switches next
+        assert second_b.result() is False
+        assert c.result() is True and lease.evicting == [B]
+        assert lease.active[B] == 2
+    asyncio.run(scenario())
+
+def test_most_waiting_waits_for_in_flight_work(loaded):
+    async def scenario():
+        lease = router.ModelLease(1, router.MostWaitingPolicy(), router.Placement({}))
+        assert await lease.acquire(A) is False
+        b = asyncio.create_task(lease.acquire(B))
+        await settle()
+        assert not b.done()
+        lease.release(A)
+        await settle()
+        assert b.result() is True
+    asyncio.run(scenario())
+
+def test_cancelled_waiter_leaves_the_queue(loaded):
+    async def scenario():
+        lease = router.ModelLease(1, router.MostWaitingPolicy(), router.Placement({}))
+        assert await lease.acquire(A) is False
+        b = asyncio.create_task(lease.acquire(B))
+        await settle()
+        b.cancel()
+        await asyncio.gather(b, return_exceptions=True)
+        assert lease.queued() == {}
+    asyncio.run(scenario())
+
+def test_switch_through_mock_backends(stack):
+    """Streams report the switch; the external service manager starts and stops the mocks"""
+    starts = httpx.get(f"{stack['llamacpp']}/mock/stats").json()["starts"]
+    for model in ("a", "b"):
+        with httpx.stream("POST", f"{stack['url']}/v1/chat/completions", timeout=30,
+                          json={"model": model, "max_tokens": 3, "messages": [{"role": "user", "content": "hi"}]}) as r:
+            text = r.read().decode()
+        assert r.status_code == 200
+        assert f"Switching to {model}" in text and "Ready!" in text and text.endswith("data: [DONE]\n\n")
+    assert httpx.get(f"{stack['llamacpp']}/mock/stats").json()["starts"] == starts + 1
+    assert httpx.get(f"{stack['sglang']}/mock/stats").json()["ready"] is False  # a was evicted
+
+def test_every_queued_stream_hears_about_the_switch(stack):
+    async def scenario():
+        body = {"model": "a2", "max_tokens": 2, "messages": [{"role": "user", "content": "hi"}]}
+        async with httpx.AsyncClient(base_url=stack["url"], timeout=30) as client:
+            responses = await asyncio.gather(*(client.post("/v1/chat/completions", json=body) for _ in range(2)))
+        return [r.text for r in responses]
+    texts = asyncio.run(scenario())
+    switcher = [t for t in texts if "Switching to a2" in t]
+    waiter = [t for t in texts if "Waiting for model switch" in t]
+    assert len(switcher) == len(waiter) == 1
+    assert "Ready!" in waiter[0] and waiter[0].endswith("data: [DONE]\n\n")
+    time.sleep(1.5)  # request log flush interval
+    records = [json.loads(line) for line in stack["request_log"].read_text().splitlines()]
+    assert [r["switch"] > 0 for r in records if r["model"] == "a2"] == [True, True]
+
+def test_draining_model_turns_new_requests_away(stack):
+    async def scenario():
+        async with httpx.AsyncClient(base_url=stack["url"], timeout=30) as client:
+            await client.post("/v1/chat/completions", json={"model": "a", "stream": False, "max_tokens": 1, "messages": []})
+            long = asyncio.create_task(client.post("/v1/chat/completions", json={"model": "a", "max_tokens": 300, "messages": []}))
+            await asyncio.sleep(0.3)
+            switch = asyncio.create_task(client.post("/v1/chat/completions", json={"model": "b", "max_tokens": 2, "messages": []}))
+            await asyncio.sleep(0.3)
+            late = await client.post("/v1/chat/completions", json={"model": "a", "stream": False, "max_tokens": 1, "messages": []})
+            await asyncio.gather(long, switch)
+            return late, long.result()
+    late, long = asyncio.run(scenario())
+    assert late.status_code == 503 and "Retry-After" in late.headers
+    assert long.text.endswith("data: [DONE]\n\n")  # drained, not cut off
@@ -0,0 +1,15 @@
+import router
+
+def test_label_values_are_escaped():
+    counter = router.MetricCounter("t_total", "test", ("model",))
+    counter.inc('we"ird\\name\nx')
+    assert list(counter.render())[-1] == 't_total{model="we\\"ird\\\\name\\nx"} 1.0'
+
+def test_histogram_buckets_are_cumulative():
+    histogram = router.Histogram("t_seconds", "test", ("model",), buckets=(1, 2))
+    for value in (0.5, 1.5, 3):
+        histogram.observe(value, "m")
+    lines = list(histogram.render())
+    assert lines[1:4] == ['t_seconds_bucket{model="m",le="1"} 1', 't_seconds_bucket{model="m",le="2"} 2',
+                          't_seconds_bucket{model="m",le="+Inf"} 3']
+    assert lines[-1] == 't_seconds_count{model="m"} 3'
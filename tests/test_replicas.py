@@ -0,0 +1,29 @@
+import router
+
+def replicas(n=3):
+    rr = router.ReplicaRouter({}, None)
+    rr.sets["m"] = [router.Replica(f"http://r{i}", None) for i in range(n)]
+    return rr
+
+def test_follow_up_turns_keep_their_replica():
+    rr = replicas()
+    system = {"role": "system", "content": "You are terse."}
+    turns = [[system, {"role": "user", "content": "hi"}]]
+    turns.append(turns[0] + [{"role": "assistant", "content": "hello"}, {"role": "user", "content": "how are you?"}])
+    turns.append(turns[1] + [{"role": "assistant", "content": "fine"}, {"role": "user", "content": "bye"}])
+    first = rr.pick("m", {"messages": turns[0]})
+    first.outstanding += 2  # busier than the others, but within max_skew
+    assert [rr.pick("m", {"messages": t}) for t in turns[1:]] == [first, first]
+
+def test_new_conversation_goes_to_least_loaded():
+    rr = replicas()
+    busy = rr.pick("m", {"messages": [{"role": "user", "content": "one"}]})
+    busy.outstanding += 1
+    assert rr.pick("m", {"messages": [{"role": "user", "content": "two"}]}) is not busy
+
+def test_skewed_replica_is_not_held():
+    rr = replicas(2)
+    messages = [{"role": "user", "content": "hi"}]
+    held = rr.pick("m", {"messages": messages})
+    held.outstanding = rr.max_skew + 1
+    assert rr.pick("m", {"messages": messages}) is not held
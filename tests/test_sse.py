@@ -0,0 +1,57 @@
+import json
+
+import router
+
+def frames(*events):
+    return b"".join(b"data: " + json.dumps(e, ensure_ascii=False).encode() + b"\n\n" for e in events)
+
+def test_parser_splits_events_across_reads():
+    parser = router.SSEParser()
+    stream = frames({"n": 1}, {"n": 2}) + b"data: [DONE]\n\n"
+    events = []
+    for i in range(len(stream)):
+        events += parser.feed(stream[i:i + 1])
+    assert events == [b'{"n": 1}', b'{"n": 2}', b"[DONE]"]
+
+def test_parser_crlf_and_lone_cr():
+    parser = router.SSEParser()
+    # a \r\n pair split between two reads is one line ending, not two
+    assert parser.feed(b"data: a\r") == []
+    assert parser.feed(b"\n\r\ndata: b\r\r") == [b"a"]
+    assert parser.feed(b"data: c\n\n") == [b"b", b"c"]
+
+def test_parser_multiline_data_and_fields():
+    parser = router.SSEParser()
+    assert parser.feed(b": keep-alive\n\nevent: x\ndata: one\ndata:two\nid: 3\n\n") == [b"one\ntwo"]
+
+def test_parser_keeps_split_utf8_intact():
+    parser = router.SSEParser()
+    raw = frames({"text": "héllo ✓"})
+    cut = raw.index("✓".encode()) + 1  # inside the three-byte character
+    assert parser.feed(raw[:cut]) == []
+    [data] = parser.feed(raw[cut:])
+    assert json.loads(data) == {"text": "héllo ✓"}
+
+def generate_events(texts, prompt_tokens=7):
+    out = []
+    for i, text in enumerate(texts):
+        meta = {"prompt_tokens": prompt_tokens, "completion_tokens": i + 1, "finish_reason": None}
+        if i == len(texts) - 1:
+            meta["finish_reason"] = {"type": "length", "length": len(texts)}
+        out.append(json.dumps({"text": text, "meta_info": meta}, ensure_ascii=False).encode())
+    return out
+
+def test_generate_stream_deltas_finish_and_usage():
+    gen = router.GenerateStream("m", {"prompt": "hi", "stream_options": {"include_usage": True}})
+    chunks = [c for data in generate_events(["Hel", "lo", " ✓"]) for c in gen.translate(gen.parse(data))]
+    text = [c["choices"][0]["text"] for c in chunks if c["choices"] and c["choices"][0].get("text")]
+    assert text == ["Hel", "lo", " ✓"]
+    assert {c["id"] for c in chunks} == {gen.id} and gen.id.startswith("cmpl-")
+    assert [c["choices"][0]["finish_reason"] for c in chunks if c["choices"] and c["choices"][0]["finish_reason"]] == ["length"]
+    assert chunks[-1]["usage"] == {"prompt_tokens": 7, "completion_tokens": 3, "total_tokens": 10}
+
+def test_generate_stream_chat_chunks():
+    gen = router.GenerateStream("m", {"messages": []}, chat=True)
+    chunks = [c for data in generate_events(["a", "b"]) for c in gen.translate(gen.parse(data))]
+    assert chunks[0]["object"] == "chat.completion.chunk"
+    assert "".join(c["choices"][0]["delta"].get("content", "") for c in chunks if c["choices"]) == "ab"